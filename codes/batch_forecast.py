@@ -0,0 +1,144 @@
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+
+import pandas as pd
+
+from forecast_service import combine_data, read_emissions_csv, to_long_format
+from forecasters import fit_damped_trend, forecast_damped_trend
+
+# Every file is forecast up to and including this year
+TARGET_YEAR = 2050
+
+OUTPUT_COLUMNS = ['source', 'company', 'scope', 'year', 'date', 'original', 'prediction']
+
+
+# Emission CSVs named by the command line: directories are searched for *.csv, anything else is a glob
+def find_emission_files(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(glob.glob(os.path.join(item, '*.csv'))))
+        else:
+            paths.extend(sorted(glob.glob(item)))
+    return list(dict.fromkeys(paths))
+
+
+# Number of predictions combine_data needs for its last prediction to fall in target_year
+# (it dates them at the year ends following the day after the last observation)
+def horizon_to(last_date, target_year=TARGET_YEAR):
+    return max(target_year - (last_date + pd.DateOffset(1)).year + 1, 1)
+
+
+# Fit and forecast every scope of one file and return it in the long format of the HTTP API
+def forecast_file(path, target_year=TARGET_YEAR):
+    label = os.path.splitext(os.path.basename(path))[0]
+    user_data = read_emissions_csv(path, label).sort_index()
+    frames = []
+    for column in user_data.columns:
+        history = user_data[[column]].dropna()
+        if history.empty:
+            continue
+        fh = horizon_to(history.index[-1], target_year)
+        prediction = forecast_damped_trend(fit_damped_trend(history[column].to_numpy(dtype='float64')), fh)
+        frames.append(combine_data(history, prediction, column.removesuffix(' Original')))
+    if not frames:
+        raise ValueError("no emission values found")
+
+    long = to_long_format(pd.concat(frames, axis=1))
+    long.insert(0, 'source', path)
+    return long
+
+
+# Pool task: never raises, so one bad file cannot stop a run over thousands of them
+def _forecast_task(task):
+    path, target_year = task
+    start = time.perf_counter()
+    try:
+        result, error = forecast_file(path, target_year), None
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+    return path, result, error, time.perf_counter() - start
+
+
+# Appends result frames to one CSV or Parquet file as they arrive, so memory stays flat
+class ResultWriter:
+    """Streams long-format forecasts to a single output file, chosen by its extension."""
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.parquet = output_path.endswith('.parquet')
+        self._writer = None
+        self._file = None
+
+    def write(self, frame):
+        frame = frame[OUTPUT_COLUMNS]
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.output_path, table.schema)
+            self._writer.write_table(table.cast(self._writer.schema))
+        else:
+            if self._file is None:
+                self._file = open(self.output_path, 'w', newline='', encoding='utf-8')
+                self._file.write(','.join(OUTPUT_COLUMNS) + '\n')
+            frame.to_csv(self._file, header=False, index=False, date_format='%Y-%m-%d')
+            self._file.flush()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forecast many 'Year,ScopeN' emission CSVs to 2050 in parallel.")
+    parser.add_argument('inputs', nargs='+', help="directories of CSV files or glob patterns, e.g. 'suppliers/*.csv'")
+    parser.add_argument('-o', '--output', default='forecasts.csv', help="output file (.csv or .parquet)")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--target-year', type=int, default=TARGET_YEAR, help="last forecast year")
+    parser.add_argument('--chunksize', type=int, default=8, help="files handed to a worker at a time")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only print the summary")
+    args = parser.parse_args()
+
+    paths = find_emission_files(args.inputs)
+    if not paths:
+        parser.error("no CSV files found")
+
+    done, failed, rows = 0, 0, 0
+    start = time.perf_counter()
+    tasks = [(path, args.target_year) for path in paths]
+    with multiprocessing.Pool(min(args.workers, len(paths))) as pool, ResultWriter(args.output) as writer:
+        for path, result, error, seconds in pool.imap_unordered(_forecast_task, tasks, chunksize=args.chunksize):
+            if error is not None:
+                failed += 1
+                print(f"FAILED {path}: {error}", file=sys.stderr)
+                continue
+            writer.write(result)
+            done += 1
+            rows += len(result)
+            if not args.quiet:
+                print(f"{path}: {len(result)} rows in {seconds * 1000:.1f} ms ({1 / seconds:.1f} files/s)")
+
+    elapsed = time.perf_counter() - start
+    print(f"Forecast {done} of {len(paths)} files ({rows} rows) to {args.output} in {elapsed:.2f} s, "
+          f"{done / elapsed:.1f} files/s with {min(args.workers, len(paths))} workers"
+          + (f", {failed} failed" if failed else ""))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    # Usage (from the repository root): python codes/batch_forecast.py data -o forecasts.csv
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from forecasters import fit_damped_trend, fit_damped_trend_panel, forecast_damped_trend, forecast_damped_trend_panel
+from panel_forecast import forecast_panel
+
+
+# Random annual emission series: a positive base with a trend and noise, like the company data
+def synthetic_series(n_series, n_years, seed=0):
+    rng = np.random.default_rng(seed)
+    base = rng.uniform(1e4, 1e8, size=(n_series, 1))
+    growth = rng.normal(0.05, 0.1, size=(n_series, 1))
+    noise = rng.normal(0, 0.05, size=(n_series, n_years))
+    return base * np.cumprod(1 + growth + noise, axis=1)
+
+
+def time_call(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_panel(panel, horizon):
+    forecast_damped_trend_panel(fit_damped_trend_panel(panel), horizon)
+
+
+def bench_loop(panel, horizon):
+    for row in panel:
+        forecast_damped_trend(fit_damped_trend(row), horizon)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare batched panel forecasting with one fit per series.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[15, 150, 1500, 15000], help="numbers of series to benchmark")
+    parser.add_argument('--years', type=int, default=6, help="years of history per series")
+    parser.add_argument('--horizon', type=int, default=30, help="forecast horizon in years")
+    parser.add_argument('--loop-limit', type=int, default=1500, help="largest size also timed with the per-series loop")
+    parser.add_argument('--repeat', type=int, default=3, help="timing repetitions (best is reported)")
+    args = parser.parse_args()
+
+    rows = []
+    for n_series in args.sizes:
+        panel = synthetic_series(n_series, args.years)
+        panel_seconds = time_call(lambda: bench_panel(panel, args.horizon), args.repeat)
+        row = {'series': n_series, 'panel_s': panel_seconds, 'panel_series_per_s': n_series / panel_seconds}
+        if n_series <= args.loop_limit:
+            loop_seconds = time_call(lambda: bench_loop(panel, args.horizon), args.repeat)
+            row.update({'loop_s': loop_seconds, 'loop_series_per_s': n_series / loop_seconds, 'speedup': loop_seconds / panel_seconds})
+        rows.append(row)
+
+    # End to end on date-indexed frames, including stacking, for the largest size
+    n_series = args.sizes[-1]
+    index = pd.date_range('2017-01-01', periods=args.years, freq='YS')
+    series = {f'Entity {i} Scope 1': pd.Series(values, index=index) for i, values in enumerate(synthetic_series(n_series, args.years))}
+    end_to_end = time_call(lambda: forecast_panel(series, args.horizon), args.repeat)
+
+    pd.set_option('display.float_format', '{:,.4f}'.format)
+    print(pd.DataFrame(rows).set_index('series').to_string())
+    print(f"\nforecast_panel on {n_series} date-indexed series (stack + fit + forecast): {end_to_end:.4f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from forecast_service import SCOPES, combine_data, get_history_store, scope_names
+from model_registry import discover_model_paths
+
+SECTIONS = ('unpickle', 'predict', 'assemble', 'app')
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streamlitdeploy.py')
+
+
+# Peak resident set size of this process so far, in MiB (ru_maxrss is KiB on Linux, bytes on macOS)
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def time_calls(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+# p50/p95/min/max of a list of timings, in milliseconds
+def summarise(timings):
+    ms = np.asarray(timings) * 1000
+    return {'n': len(ms), 'p50_ms': float(np.percentile(ms, 50)), 'p95_ms': float(np.percentile(ms, 95)),
+            'min_ms': float(ms.min()), 'max_ms': float(ms.max())}
+
+
+# Summary over every call of a section plus a breakdown per model (or company)
+def section_result(timings_by_name):
+    every = [t for timings in timings_by_name.values() for t in timings]
+    return {**summarise(every), 'peak_rss_mb': peak_rss_mb(),
+            'items': {name: summarise(timings) for name, timings in timings_by_name.items()}}
+
+
+def bench_unpickle(model_paths, repeat):
+    from pycaret.time_series import load_model
+    return section_result({name: time_calls(lambda: load_model(path, verbose=False), repeat)
+                           for name, path in model_paths.items()})
+
+
+# Every model is unpickled before the clock starts, so the timings and peak memory are inference alone
+def bench_predict(model_paths, repeat):
+    from pycaret.time_series import load_model, predict_model
+    models = {name: load_model(path, verbose=False) for name, path in model_paths.items()}
+    return section_result({name: time_calls(lambda: predict_model(models[name], fh=30), repeat)
+                           for name in model_paths})
+
+
+# combine_data for every scope of a company and the pd.concat into the app's chart frame
+def bench_assemble(model_paths, repeat):
+    from forecast_store import FORECAST_HORIZON
+    history = get_history_store()
+    predictions = {name: np.arange(FORECAST_HORIZON, dtype='float64') for name in model_paths}
+    companies = sorted({name.rsplit(' Scope ', 1)[0] for name in model_paths})
+
+    def assemble(company):
+        frames = [combine_data(history[name], predictions[name], name) for name in scope_names(company, SCOPES) if name in predictions]
+        return pd.concat(frames, axis=1)
+
+    return section_result({company: time_calls(lambda: assemble(company), repeat) for company in companies})
+
+
+# Full headless runs of the app; the first run in this process also pays for imports and model loading
+def bench_app(runs, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    def run_app():
+        app = AppTest.from_file(APP_PATH, default_timeout=timeout).run()
+        if app.exception:
+            raise RuntimeError(f"App raised: {app.exception[0].value}")
+
+    timings = time_calls(run_app, runs)
+    return section_result({'first run': timings[:1], 'later runs': timings[1:]} if runs > 1 else {'first run': timings})
+
+
+# Sections whose p95 grew by more than tolerance (a fraction) relative to a previous report
+def find_regressions(report, baseline, tolerance):
+    regressions = []
+    for section, result in report['sections'].items():
+        previous = baseline.get('sections', {}).get(section)
+        if previous and result['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{section}: p95 {previous['p95_ms']:.1f} ms -> {result['p95_ms']:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time model loading, inference, data assembly and a full app run; prints JSON.")
+    parser.add_argument('--sections', nargs='+', choices=SECTIONS, default=list(SECTIONS), help="sections to run, in order")
+    parser.add_argument('--repeat', type=int, default=5, help="timed calls per model or company")
+    parser.add_argument('--app-runs', type=int, default=3, help="headless app runs")
+    parser.add_argument('--app-timeout', type=float, default=300, help="seconds allowed per app run")
+    parser.add_argument('--model-dir', default='model', help="directory of <company>_scope<N>_model.pkl files")
+    parser.add_argument('-o', '--output', help="also write the JSON report to this file")
+    parser.add_argument('--baseline', help="previous JSON report; exit with status 1 if a section's p95 regressed")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed p95 growth over the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    model_paths = discover_model_paths(args.model_dir)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'models': len(model_paths),
+        'repeat': args.repeat,
+        'sections': {},
+    }
+    for section in args.sections:
+        if section == 'unpickle':
+            report['sections'][section] = bench_unpickle(model_paths, args.repeat)
+        elif section == 'predict':
+            report['sections'][section] = bench_predict(model_paths, args.repeat)
+        elif section == 'assemble':
+            report['sections'][section] = bench_assemble(model_paths, args.repeat)
+        else:
+            report['sections'][section] = bench_app(args.app_runs, args.app_timeout)
+    report['peak_rss_mb'] = peak_rss_mb()
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    # Usage (from the repository root): python codes/bench_pipeline.py -o bench.json
+    sys.exit(main())
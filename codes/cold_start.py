@@ -0,0 +1,119 @@
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import span
+
+# Imports pulled in only for live inference; everything else the app serves needs pandas/NumPy alone
+HEAVY_MODULES = ('pycaret', 'sktime', 'statsmodels', 'sklearn', 'lightgbm')
+
+# Modules imported by the app and the API before their first response
+STARTUP_IMPORTS = ('streamlit', 'plotly.express', 'forecast_service', 'milestones', 'stage_cache', 'upload_forecast', 'upload_ingest')
+
+_timings = {}
+_timings_lock = threading.Lock()
+_pycaret_lock = threading.Lock()
+_warm_up_lock = threading.Lock()
+_warm_up_thread = None
+
+
+def record_timing(phase, seconds):
+    with _timings_lock:
+        _timings.setdefault(phase, seconds)
+
+
+# Time a start-up phase once per process; later runs of the same phase are not recorded
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    with span(phase):
+        yield
+    record_timing(phase, time.perf_counter() - start)
+
+
+# Seconds spent in each recorded start-up phase of this process, in the order they finished
+def startup_timings():
+    with _timings_lock:
+        return dict(_timings)
+
+
+def heavy_modules_loaded():
+    return sorted(name for name in HEAVY_MODULES if name in sys.modules)
+
+
+# pycaret.time_series, imported on first use (live inference or the warm-up thread) and timed
+def pycaret_time_series():
+    with _pycaret_lock:
+        if 'pycaret.time_series' in sys.modules:
+            return sys.modules['pycaret.time_series']
+        # The first live inference of the process pays for this import, so it shows up in its trace
+        with timed('import pycaret.time_series'):
+            return importlib.import_module('pycaret.time_series')
+
+
+# Import the modelling stack in a daemon thread so the first live inference does not pay for it.
+# Idempotent; the first page is rendered from precomputed forecasts while this runs.
+def start_warm_up():
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=pycaret_time_series, name='pycaret-warm-up', daemon=True)
+            _warm_up_thread.start()
+        return _warm_up_thread
+
+
+# Parse the stderr of 'python -X importtime' into {module: (self_us, cumulative_us)}
+def parse_importtime(text):
+    modules = {}
+    for line in text.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+# Import the app's start-up modules in a fresh interpreter with -X importtime and summarise the cost
+def import_time_report(modules=STARTUP_IMPORTS, top=15):
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    script = '; '.join(f'import {module}' for module in modules)
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], cwd=os.getcwd(), capture_output=True, text=True,
+                               env={**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [code_dir, os.environ.get('PYTHONPATH')]))})
+    wall_seconds = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+
+    imported = parse_importtime(completed.stderr)
+    top_level = {name: cumulative for name, (_, cumulative) in imported.items() if '.' not in name}
+    slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        'modules': list(modules),
+        'wall_seconds': wall_seconds,
+        'import_seconds': sum(self_us for self_us, _ in imported.values()) / 1e6,
+        'heavy_modules_imported': sorted(name for name in HEAVY_MODULES if name in imported),
+        'slowest_top_level_seconds': {name: cumulative / 1e6 for name, cumulative in slowest},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report how long the app's start-up imports take in a fresh interpreter.")
+    parser.add_argument('--modules', nargs='+', default=list(STARTUP_IMPORTS), help="modules to import")
+    parser.add_argument('--top', type=int, default=15, help="number of slowest top-level packages to list")
+    parser.add_argument('--fail-on-heavy', action='store_true', help="exit with status 1 if a modelling package is imported at start-up")
+    args = parser.parse_args()
+
+    report = import_time_report(args.modules, args.top)
+    print(json.dumps(report, indent=2))
+    return 1 if args.fail_on_heavy and report['heavy_modules_imported'] else 0
+
+
+if __name__ == '__main__':
+    # Usage (from the repository root): python codes/cold_start.py --fail-on-heavy
+    sys.exit(main())
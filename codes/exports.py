@@ -0,0 +1,188 @@
+import hashlib
+import importlib.util
+import os
+import tempfile
+import threading
+
+import pandas as pd
+
+# Serialised downloads are kept here as '<fingerprint>.<extension>' and shared by every session
+DEFAULT_EXPORT_DIR = 'model/exports'
+
+# Disk space the export files may take, in MiB, before the least recently used ones are deleted
+DEFAULT_EXPORT_MB = 512
+
+EXPORT_FORMATS = {
+    'csv': {'label': 'CSV', 'extension': 'csv', 'mime': 'text/csv'},
+    'parquet': {'label': 'Parquet', 'extension': 'parquet', 'mime': 'application/vnd.apache.parquet'},
+    'xlsx': {'label': 'Excel', 'extension': 'xlsx', 'mime': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'},
+}
+
+EXCEL_SHEET_NAME = 'forecasts'
+
+
+# Excel writer pandas can use here, if any
+def excel_engine():
+    for engine in ('xlsxwriter', 'openpyxl'):
+        if importlib.util.find_spec(engine) is not None:
+            return engine
+    return None
+
+
+# Formats that can be written in this environment (Excel needs xlsxwriter or openpyxl)
+def available_formats():
+    return [export_format for export_format in EXPORT_FORMATS if export_format != 'xlsx' or excel_engine()]
+
+
+def export_fingerprint(key):
+    return hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+
+
+# Each writer takes an iterable of frames with the same columns and appends them to one file as they
+# arrive, so only one chunk is ever in memory
+def write_csv(frames, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        for i, frame in enumerate(frames):
+            frame.to_csv(f, header=i == 0, index=False, date_format='%Y-%m-%d')
+
+
+def write_parquet(frames, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for frame in frames:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+# Both Excel engines assemble the workbook in memory until it is closed (pandas writes cells column by
+# column, which rules out xlsxwriter's row-streaming mode), so chunks only bound the frames themselves
+def write_excel(frames, path):
+    engine = excel_engine()
+    if engine is None:
+        raise ImportError("Excel export needs xlsxwriter or openpyxl; install one of them, or export CSV or Parquet")
+    with pd.ExcelWriter(path, engine=engine) as writer:
+        row = 0
+        for frame in frames:
+            frame.to_excel(writer, sheet_name=EXCEL_SHEET_NAME, index=False, header=row == 0, startrow=row)
+            row += len(frame) + (row == 0)
+
+
+WRITERS = {'csv': write_csv, 'parquet': write_parquet, 'xlsx': write_excel}
+
+
+class ExportCache:
+    """Downloadable files on disk, written on first request and keyed by the fingerprint of their data.
+
+    Nothing is serialised until someone asks for it. The file is then written chunk by chunk from the
+    frames a function yields, and every later request for the same data and format, from any session,
+    reads the same file. Past max_bytes the least recently used files are deleted.
+    """
+
+    def __init__(self, export_dir=DEFAULT_EXPORT_DIR, max_bytes=DEFAULT_EXPORT_MB * 1024 * 1024):
+        self.export_dir = export_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._path_locks = {}
+
+    def _directory(self):
+        try:
+            os.makedirs(self.export_dir, exist_ok=True)
+        except OSError:
+            # Read-only deployments still export, into a temporary directory
+            self.export_dir = tempfile.mkdtemp(prefix='carboncast-exports-')
+        return self.export_dir
+
+    # Path of the export of frames_fn(*args) for key in the given format, writing it if it is not cached yet.
+    # The file may be evicted once this returns; use open() or read() to get its contents.
+    def get(self, key, export_format, frames_fn, *args):
+        return self._fetch(key, export_format, frames_fn, args, open_file=False)
+
+    # The export opened for binary reading. It is opened before it can be evicted, and an open file stays
+    # readable after it is deleted.
+    def open(self, key, export_format, frames_fn, *args):
+        return self._fetch(key, export_format, frames_fn, args, open_file=True)
+
+    def read(self, key, export_format, frames_fn, *args):
+        with self.open(key, export_format, frames_fn, *args) as f:
+            return f.read()
+
+    def _fetch(self, key, export_format, frames_fn, args, open_file):
+        if export_format not in WRITERS:
+            raise ValueError(f"Unknown export format {export_format!r}; expected one of {', '.join(EXPORT_FORMATS)}")
+        path = os.path.join(self._directory(), f"{export_fingerprint(key)[:32]}.{EXPORT_FORMATS[export_format]['extension']}")
+        with self._lock:
+            path_lock = self._path_locks.setdefault(path, threading.Lock())
+
+        # Sessions asking for the same export at once wait for one writer rather than each writing it.
+        # Eviction skips files whose lock is held, so the file is still there when it is opened here.
+        with path_lock:
+            try:
+                os.utime(path)
+                result = open(path, 'rb') if open_file else path
+            except FileNotFoundError:
+                # Not written yet, or evicted by another process
+                pass
+            else:
+                self.hits += 1
+                return result
+            # Partly written files are hidden, and keep their extension for writers that check it
+            tmp_path = os.path.join(self.export_dir, f".{os.getpid()}.{os.path.basename(path)}")
+            try:
+                WRITERS[export_format](frames_fn(*args), tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.misses += 1
+            result = open(path, 'rb') if open_file else path
+        self._evict(keep=path)
+        return result
+
+    def total_bytes(self):
+        return sum(size for _, size, _ in self._stats())
+
+    def _files(self):
+        if not os.path.isdir(self.export_dir):
+            return []
+        return [os.path.join(self.export_dir, name) for name in os.listdir(self.export_dir) if not name.startswith('.')]
+
+    # (mtime, size, path) of every export, oldest first, leaving out files another process removed meanwhile
+    def _stats(self):
+        stats = []
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stats.append((stat.st_mtime, stat.st_size, path))
+        return sorted(stats)
+
+    # Files being written or opened in this process are skipped; files already open stay readable after
+    # they are deleted here
+    def _evict(self, keep):
+        with self._lock:
+            stats = self._stats()
+            total = sum(size for _, size, _ in stats)
+            for _, size, path in stats:
+                if total <= self.max_bytes:
+                    break
+                path_lock = self._path_locks.setdefault(path, threading.Lock())
+                if path == keep or not path_lock.acquire(blocking=False):
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                finally:
+                    path_lock.release()
+                total -= size
@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from exports import EXPORT_FORMATS
+from forecast_service import (SCOPES, combine_data, export_forecast_cube, get_forecast_store, get_history_store,
+                              get_model_registry, get_trace_recorder, scope_names, to_long_format, warm_up_if_needed)
+from milestones import milestone_values
+from tracing import Trace
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8502
+
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+OUTPUT_FORMATS = ('json', 'arrow')
+PROMETHEUS_MEDIA_TYPE = 'text/plain; version=0.0.4'
+
+# Bytes of an export file read into memory at a time while it is sent
+EXPORT_CHUNK_BYTES = 1024 * 1024
+
+# Concurrent requests share the forecast service's frames; copy-on-write keeps each request's changes its own
+pd.set_option('mode.copy_on_write', True)
+
+# Requests for the same model that arrive while it is being forecast share one computation
+_inflight = {}
+
+
+async def scope_predictions(model_name):
+    forecasts = get_forecast_store()
+    if forecasts.is_fresh(model_name):
+        return forecasts[model_name]
+
+    task = _inflight.get(model_name)
+    if task is None:
+        # Live inference is CPU bound, so it runs off the event loop
+        task = asyncio.ensure_future(asyncio.to_thread(forecasts.get, model_name))
+        _inflight[model_name] = task
+        task.add_done_callback(lambda _: _inflight.pop(model_name, None))
+    return await task
+
+
+# History and forecast of each scope of a company side by side, as the app charts them
+async def company_wide_frame(company, scopes=SCOPES):
+    models = get_model_registry()
+    history = get_history_store()
+    names = [model_name for model_name in scope_names(company, scopes) if model_name in models]
+    if not names:
+        raise KeyError(f"No models available for {company}")
+    predictions = await asyncio.gather(*(scope_predictions(model_name) for model_name in names))
+    frames = [combine_data(history[model_name], scope_prediction['y_pred'].values, model_name)
+              for model_name, scope_prediction in zip(names, predictions)]
+    return pd.concat(frames, axis=1)
+
+
+async def company_frame(company, scopes=SCOPES):
+    return to_long_format(await company_wide_frame(company, scopes))
+
+
+# Malformed requests raise ValueError and get a 400; only a company or scope without a model gets a 404
+def bad_request(error):
+    return JSONResponse({'error': str(error)}, status_code=400)
+
+
+# str() of a KeyError is the repr of its message, quotes included
+def not_found(error):
+    return JSONResponse({'error': error.args[0]}, status_code=404)
+
+
+def parse_int_list(value, name):
+    try:
+        return tuple(int(item) for item in value.split(','))
+    except ValueError:
+        raise ValueError(f"{name} must be comma-separated integers, got {value!r}") from None
+
+
+def parse_scopes(value):
+    return parse_int_list(value, 'scopes') if value else SCOPES
+
+
+def parse_output_format(value):
+    if value not in OUTPUT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(OUTPUT_FORMATS)}, got {value!r}")
+    return value
+
+
+# Body of a bulk request as (companies or None, scopes, format); every field is optional
+async def parse_bulk_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ValueError("Request body must be JSON") from None
+    if not isinstance(body, dict):
+        raise ValueError("Request body must be a JSON object")
+    companies, scopes = body.get('companies'), body.get('scopes')
+    if companies is not None and not (isinstance(companies, list) and all(isinstance(company, str) for company in companies)):
+        raise ValueError("companies must be a list of company names")
+    if scopes is not None and not (isinstance(scopes, list) and all(type(scope) is int for scope in scopes)):
+        raise ValueError("scopes must be a list of integers")
+    output_format = parse_output_format(request.query_params.get('format', body.get('format', 'json')))
+    return companies or None, tuple(scopes or SCOPES), output_format
+
+
+# Long-format frame as JSON records or as an Arrow IPC stream, depending on ?format=
+def frame_response(frame, output_format):
+    if output_format == 'arrow':
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(sink.getvalue().to_pybytes(), media_type=ARROW_MEDIA_TYPE)
+    records = frame.assign(date=frame['date'].dt.strftime('%Y-%m-%d'))
+    return JSONResponse({'rows': records.astype(object).where(records.notna(), None).to_dict(orient='records')})
+
+
+async def health(request):
+    return JSONResponse({'status': 'ok'})
+
+
+async def companies(request):
+    return JSONResponse({'companies': get_model_registry().companies()})
+
+
+async def company_forecast(request):
+    company = request.path_params['company']
+    try:
+        scopes = parse_scopes(request.query_params.get('scopes'))
+        output_format = parse_output_format(request.query_params.get('format', 'json'))
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        frame = await company_frame(company, scopes)
+    except KeyError as e:
+        return not_found(e)
+    return frame_response(frame, output_format)
+
+
+async def milestones(request):
+    company = request.path_params['company']
+    try:
+        years = list(parse_int_list(request.query_params.get('years', '2030,2050'), 'years'))
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        # Live fallbacks go through the shared in-flight batching like every other request
+        values = milestone_values(await company_wide_frame(company), years)
+    except KeyError as e:
+        return not_found(e)
+    values.columns = [column.rsplit(' ', 1)[0] for column in values.columns]
+    return JSONResponse({'company': company, 'milestones': {str(year): row.dropna().to_dict() for year, row in values.iterrows()}})
+
+
+# Body: {"companies": ["Meta", "Google"], "scopes": [1, 2, 3]}
+async def bulk_forecast(request):
+    try:
+        requested, scopes, output_format = await parse_bulk_body(request)
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        frames = await asyncio.gather(*(company_frame(company, scopes) for company in requested or get_model_registry().companies()))
+    except KeyError as e:
+        return not_found(e)
+    frame = pd.concat(frames, ignore_index=True)
+    return frame_response(frame, output_format)
+
+
+# The forecast cube as a file: ?format=csv|parquet|xlsx, optionally ?companies=Meta,Google and ?scopes=1,2.
+# It is written once per set of model versions and streamed from disk in chunks.
+async def export(request):
+    export_format = request.query_params.get('format', 'csv')
+    companies = request.query_params.get('companies')
+    companies = companies.split(',') if companies else None
+    try:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}, got {export_format!r}")
+        scopes = parse_scopes(request.query_params.get('scopes'))
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        f = await asyncio.to_thread(export_forecast_cube, export_format, companies, scopes)
+    except KeyError as e:
+        return not_found(e)
+    except ImportError as e:
+        return bad_request(e)
+    filename = f"carboncast_forecasts.{EXPORT_FORMATS[export_format]['extension']}"
+    return StreamingResponse(read_chunks(f), media_type=EXPORT_FORMATS[export_format]['mime'],
+                             headers={'Content-Length': str(os.fstat(f.fileno()).st_size),
+                                      'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+# An open file in chunks, closed once it is sent (Starlette iterates it in a worker thread)
+def read_chunks(f, chunk_size=EXPORT_CHUNK_BYTES):
+    with f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+async def metrics(request):
+    return PlainTextResponse(get_trace_recorder().prometheus_text(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+
+# The latest traces as an OTLP/JSON export request, e.g. to POST to a collector's /v1/traces
+async def traces(request):
+    return JSONResponse(get_trace_recorder().otlp_json())
+
+
+class TracingMiddleware:
+    """Records every HTTP request as a trace, named after its method and first path segment."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        trace = Trace(f"{scope['method']} /{scope['path'].strip('/').split('/')[0]}", path=scope['path']).start()
+
+        async def send_traced(message):
+            if message['type'] == 'http.response.start':
+                trace.attributes['status_code'] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            trace.finish()
+            get_trace_recorder().record(trace)
+
+
+app = Starlette(middleware=[Middleware(TracingMiddleware)], routes=[
+    Route('/health', health),
+    Route('/companies', companies),
+    Route('/forecast/{company}', company_forecast),
+    Route('/milestones/{company}', milestones),
+    Route('/forecast', bulk_forecast, methods=['POST']),
+    Route('/export', export),
+    Route('/metrics', metrics),
+    Route('/traces', traces),
+])
+
+_server_thread = None
+_server_lock = threading.Lock()
+
+
+# Serve the API from a daemon thread of the current process (e.g. the Streamlit server), so it shares
+# that process's model registry and forecast store. Calling it again is a no-op.
+def start_api_server(port=DEFAULT_PORT, host=DEFAULT_HOST):
+    global _server_thread
+    import uvicorn
+
+    with _server_lock:
+        if _server_thread is None:
+            warm_up_if_needed()
+            server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level='warning'))
+            _server_thread = threading.Thread(target=server.run, name='forecast-api', daemon=True)
+            _server_thread.start()
+    return _server_thread
+
+
+if __name__ == '__main__':
+    # Usage (from the repository root): python codes/forecast_api.py [--host HOST] [--port PORT]
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve Carbon Cast forecasts over HTTP.")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    warm_up_if_needed()
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,191 @@
+import os
+import threading
+
+import pandas as pd
+
+from cold_start import start_warm_up
+from exports import ExportCache
+from forecast_store import ForecastStore
+from hierarchy import company_total_label, reconciled_forecasts
+from history_store import HistoryStore, prediction_dates
+from milestones import MILESTONE_YEARS, milestone_values
+from model_registry import ModelRegistry
+from retrain_worker import RetrainWorker
+from scenarios import ScenarioEngine
+from tracing import TraceRecorder
+
+SCOPES = (1, 2, 3)
+
+_shared = {}
+_shared_lock = threading.RLock()
+
+
+# Process-wide singletons, so the Streamlit sessions and the HTTP API share one model cache
+def _get_shared(key, factory):
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = factory()
+        return _shared[key]
+
+
+def get_model_registry():
+    return _get_shared('models', lambda: ModelRegistry('model'))
+
+
+def get_forecast_store():
+    return _get_shared('forecasts', lambda: ForecastStore(get_model_registry()))
+
+
+def get_history_store():
+    return _get_shared('history', lambda: HistoryStore('data'))
+
+
+def get_scenario_engine():
+    return _get_shared('scenarios', lambda: ScenarioEngine(get_forecast_store(), get_history_store()))
+
+
+# Traces of app reruns and API requests; with CARBONCAST_TRACE_FILE set, each one is also appended to
+# that file as a line of OTLP/JSON
+def get_trace_recorder():
+    return _get_shared('traces', lambda: TraceRecorder(export_path=os.environ.get('CARBONCAST_TRACE_FILE')))
+
+
+def get_export_cache():
+    return _get_shared('exports', lambda: ExportCache())
+
+
+def get_retrain_worker():
+    return _get_shared('retrain', lambda: RetrainWorker(get_model_registry(), get_forecast_store(), get_history_store()))
+
+
+# Bytes held by the process-wide structures every session shares, by structure (only those created so far)
+def shared_memory_bytes():
+    with _shared_lock:
+        shared = dict(_shared)
+    report = {}
+    if 'models' in shared:
+        report['models (unpickled)'] = sum(stats['memory_bytes'] for stats in shared['models'].load_stats().values())
+    if 'forecasts' in shared:
+        report['forecasts'] = shared['forecasts'].memory_bytes()
+    if 'history' in shared:
+        report['history (memory-mapped)'] = shared['history'].memory_bytes()
+    if 'scenarios' in shared:
+        report['scenario trajectories'] = shared['scenarios'].memory_bytes()
+    return report
+
+
+# Import the modelling stack in the background when some model has neither a fresh stored forecast
+# nor a fresh native export, and so will need live inference. CARBONCAST_WARM_UP=1 always warms up,
+# =0 never does (imports then happen on first use).
+def warm_up_if_needed():
+    setting = os.environ.get('CARBONCAST_WARM_UP', 'auto')
+    if setting == '0':
+        return False
+    store = get_forecast_store()
+    if setting == '1' or any(store.needs_live_inference(model_name) for model_name in get_model_registry().model_paths):
+        start_warm_up()
+        return True
+    return False
+
+
+# Function to combine historical and prediction data
+def combine_data(historical, prediction, label):
+    # Ensure the prediction length matches the forecast horizon
+    pred_index = prediction_dates(historical, len(prediction))
+    prediction_series = pd.Series(prediction, index=pred_index, name=f'Prediction {label}')
+
+    # Combine the historical data with predictions
+    combined = pd.concat([historical, prediction_series], axis=0)
+    combined.columns = [f'{label} Original', f'{label} Prediction']
+    return combined
+
+
+# Read a 'Year,ScopeN[,...]' emissions file (path or file object) into '{label} Scope N Original' columns.
+# Scope numbers come from the headers; files whose headers carry none are taken as Scope 1, 2, 3 in order.
+def read_emissions_csv(source, label):
+    data = pd.read_csv(source, encoding='utf-8-sig', index_col='Year', parse_dates=True)
+    scopes = data.columns.str.extract(r'(\d+)\s*$', expand=False)
+    if scopes.isna().any() or scopes.duplicated().any():
+        scopes = [str(scope) for scope in range(1, len(data.columns) + 1)]
+    data.columns = [f'{label} Scope {scope} Original' for scope in scopes]
+    return data
+
+
+def scope_names(company, scopes=SCOPES):
+    return [f"{company} Scope {scope}" for scope in scopes]
+
+
+# Historical data and forecast of one model, in the two-column layout of combine_data
+def combined_forecast(model_name, predictions=None):
+    if predictions is None:
+        predictions = get_forecast_store()[model_name]
+    return combine_data(get_history_store()[model_name], predictions['y_pred'].values, model_name)
+
+
+# All available scopes of one company side by side, as the app charts them
+def company_forecast(company, scopes=SCOPES):
+    models = get_model_registry()
+    frames = [combined_forecast(model_name) for model_name in scope_names(company, scopes) if model_name in models]
+    if not frames:
+        raise KeyError(f"No models available for {company}")
+    return pd.concat(frames, axis=1)
+
+
+# Reshape a combined frame to one row per (company, scope, year) for machine consumers
+def to_long_format(combined):
+    columns = combined.columns.str.rsplit(' ', n=1, expand=True)
+    long = combined.set_axis(columns, axis=1).stack(level=0, future_stack=True).reset_index()
+    long.columns = ['date', 'series', 'original', 'prediction']
+    series = long.pop('series').str.extract(r'^(?P<company>.+) Scope (?P<scope>\d+)$')
+    long.insert(0, 'company', series['company'])
+    long.insert(1, 'scope', series['scope'].astype('int8'))
+    long.insert(2, 'year', pd.DatetimeIndex(long['date']).year)
+    return long.dropna(subset=['original', 'prediction'], how='all').sort_values(['company', 'scope', 'date'], ignore_index=True)
+
+
+# The company x scope x year forecast cube in long format, one company's frame at a time, so exports of
+# the whole portfolio are written without ever building it in one piece
+def forecast_cube(companies=None, scopes=SCOPES):
+    for company in companies or get_model_registry().companies():
+        yield to_long_format(company_forecast(company, scopes))
+
+
+# Identity of the forecast cube of some companies: the fingerprint of the history CSVs, then each model's
+# name and the hash of its file
+def forecast_cube_key(companies=None, scopes=SCOPES):
+    models = get_model_registry()
+    forecasts = get_forecast_store()
+    return ('cube', get_history_store().fingerprint()) + tuple((model_name, forecasts.model_hash(model_name)) for company in companies or models.companies()
+                             for model_name in scope_names(company, scopes) if model_name in models)
+
+
+# The forecast cube written in export_format ('csv', 'parquet' or 'xlsx'), from the export cache and opened
+# for binary reading, so it cannot be evicted before it is sent
+def export_forecast_cube(export_format, companies=None, scopes=SCOPES):
+    return get_export_cache().open(forecast_cube_key(companies, scopes), export_format, forecast_cube, companies, scopes)
+
+
+# Forecast value at each milestone year for every scope of a company (rows: years, columns: scopes)
+def company_milestones(company, years=MILESTONE_YEARS, scopes=SCOPES):
+    return milestone_values(company_forecast(company, scopes), years)
+
+
+# Coherent forecasts of every available model, each company's Scope 1+2+3 total and the portfolio,
+# reconciled in one matrix product (rows: series, columns: dates; see hierarchy.py for the methods)
+def hierarchy_forecast(method='wls', sectors=None):
+    return reconciled_forecasts(list(get_model_registry().model_paths), get_forecast_store(), get_history_store(), method, sectors)
+
+
+# A company's summed history and its reconciled total forecast, in the two-column layout of combine_data.
+# The history total only covers years where every scope has a value.
+def company_total_forecast(company, reconciled):
+    label = company_total_label(company)
+    scopes = [model_name for model_name in scope_names(company) if model_name in reconciled.index]
+    if label not in reconciled.index:
+        raise KeyError(f"No models available for {company}")
+    history = get_history_store()
+    historical = pd.concat([history[model_name].iloc[:, 0] for model_name in scopes], axis=1).sum(axis=1, min_count=len(scopes))
+    prediction = reconciled.loc[label]
+    combined = pd.concat([historical.dropna(), prediction], axis=1)
+    combined.columns = [f'{label} Original', f'{label} Prediction']
+    return combined
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import sys
+import threading
+
+import pandas as pd
+
+from cold_start import pycaret_time_series
+from memory_budget import object_bytes, session_view
+from model_registry import ModelRegistry
+from native_models import DEFAULT_NATIVE_PATH, load_native_models, native_forecast
+from tracing import span
+
+# Every model is forecast 30 years ahead, which takes the charts past 2050
+FORECAST_HORIZON = 30
+
+# Coverage of the stored prediction intervals (lower/upper columns)
+INTERVAL_COVERAGE = 0.9
+
+DEFAULT_STORE_PATH = 'model/forecasts.parquet'
+
+
+# Content hash of a model pickle; the store is only trusted for the exact file it was built from
+def model_file_hash(model_path):
+    with open(model_path + '.pkl', 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# Run one model and return its horizon as a tidy frame: year, y_pred, lower, upper
+def run_forecast(model, fh=FORECAST_HORIZON):
+    time_series = pycaret_time_series()
+    with span('predict_model', fh=fh):
+        predictions = time_series.predict_model(model, fh=fh, return_pred_int=True, coverage=INTERVAL_COVERAGE)
+    return pd.DataFrame({
+        'year': predictions.index.year.astype('int16'),
+        'y_pred': predictions['y_pred'].to_numpy(dtype='float64'),
+        'lower': predictions['lower'].to_numpy(dtype='float64'),
+        'upper': predictions['upper'].to_numpy(dtype='float64'),
+    })
+
+
+# One model's horizon in the store layout: model_name, model_hash, step, year, y_pred, lower, upper
+def _store_rows(model_name, model_hash, forecast):
+    forecast = forecast.copy()
+    forecast.insert(0, 'step', pd.RangeIndex(1, len(forecast) + 1).astype('int16'))
+    forecast.insert(0, 'model_hash', model_hash)
+    forecast.insert(0, 'model_name', model_name)
+    return forecast
+
+
+# Write through a temporary file so readers never see a half-written store
+def _write_store(frames, store_path):
+    store = pd.concat(frames, ignore_index=True)
+    store['model_name'] = store['model_name'].astype('category')
+    store['model_hash'] = store['model_hash'].astype('category')
+    store.to_parquet(store_path + '.tmp', index=False)
+    os.replace(store_path + '.tmp', store_path)
+    return store
+
+
+# Offline build step: forecast every model once and write all horizons to a single Parquet file
+def build_forecast_store(registry, store_path=DEFAULT_STORE_PATH):
+    frames = [_store_rows(model_name, model_file_hash(model_path), run_forecast(registry[model_name]))
+              for model_name, model_path in registry.model_paths.items()]
+    return _write_store(frames, store_path)
+
+
+# Replace the stored horizons of some models ({model_name: (model_hash, forecast)}), keeping every other row
+def update_forecast_store(updates, store_path=DEFAULT_STORE_PATH):
+    frames = []
+    if os.path.exists(store_path):
+        store = pd.read_parquet(store_path)
+        kept = store[~store['model_name'].isin(list(updates))]
+        frames.append(kept.astype({'model_name': str, 'model_hash': str}))
+    frames.extend(_store_rows(model_name, model_hash, forecast) for model_name, (model_hash, forecast) in updates.items())
+    return _write_store(frames, store_path)
+
+
+# Turn a stored horizon back into the shape predict_model returns (annual PeriodIndex)
+def _to_predictions(forecast):
+    index = pd.PeriodIndex(forecast['year'].astype(int), freq='Y')
+    return pd.DataFrame(forecast[['y_pred', 'lower', 'upper']].to_numpy(), index=index, columns=['y_pred', 'lower', 'upper'])
+
+
+class ForecastStore:
+    """Serves precomputed forecasts, falling back to live inference when a model file changed.
+
+    Forecasts are looked up by model name and validated against the hash of the model
+    pickle on disk. A model missing from the store is next tried in its native NumPy export
+    (model/native_models.json), and only then run through PyCaret. Live results are kept in
+    memory so a changed model is only run once per process until the store is rebuilt.
+    """
+
+    def __init__(self, registry, store_path=DEFAULT_STORE_PATH, native_path=DEFAULT_NATIVE_PATH):
+        self.registry = registry
+        self.store_path = store_path
+        self._native = load_native_models(native_path)
+        self._stored = {}
+        self._live = {}
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(store_path):
+            store = pd.read_parquet(store_path)
+            for (model_name, model_hash), forecast in store.groupby(['model_name', 'model_hash'], observed=True, sort=False):
+                self._stored[model_name] = (model_hash, _to_predictions(forecast.sort_values('step')))
+
+    # Hash lookups are cached on (mtime, size) so unchanged files are not re-read on every rerun
+    def model_hash(self, model_name):
+        model_path = self.registry.model_paths[model_name]
+        stat = os.stat(model_path + '.pkl')
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._file_hashes.get(model_name)
+        if cached is None or cached[0] != key:
+            cached = (key, model_file_hash(model_path))
+            self._file_hashes[model_name] = cached
+        return cached[1]
+
+    def is_fresh(self, model_name):
+        stored = self._stored.get(model_name)
+        return stored is not None and stored[0] == self.model_hash(model_name)
+
+    # True when neither the stored forecast nor the native export matches the model file, so PyCaret is needed
+    def needs_live_inference(self, model_name):
+        native = self._native.get(model_name)
+        return not self.is_fresh(model_name) and (native is None or native['model_hash'] != self.model_hash(model_name))
+
+    def get(self, model_name):
+        model_hash = self.model_hash(model_name)
+        stored = self._stored.get(model_name)
+        if stored is not None and stored[0] == model_hash:
+            return session_view(stored[1])
+
+        live = self._live.get(model_name)
+        if live is not None and live[0] == model_hash:
+            return session_view(live[1])
+
+        with self._lock:
+            live = self._live.get(model_name)
+            if live is None or live[0] != model_hash:
+                native = self._native.get(model_name)
+                if native is not None and native['model_hash'] == model_hash:
+                    with span('native forecast', model=model_name):
+                        live = (model_hash, native_forecast(native, FORECAST_HORIZON))
+                else:
+                    with span('live inference', model=model_name):
+                        live = (model_hash, _to_predictions(run_forecast(self.registry[model_name])))
+                self._live[model_name] = live
+        return session_view(live[1])
+
+    def __getitem__(self, model_name):
+        return self.get(model_name)
+
+    # Serve a new forecast (and native export) for a model whose pickle is about to be replaced.
+    # The forecast is staged as a live result first, so requests see the old forecast while the old
+    # file is on disk and the new one as soon as the new file is, then becomes the stored entry.
+    def stage(self, model_name, model_hash, forecast, native=None):
+        predictions = _to_predictions(forecast)
+        with self._lock:
+            self._live[model_name] = (model_hash, predictions)
+            if native is not None:
+                self._native[model_name] = {'model_hash': model_hash, **native}
+
+    def memory_bytes(self):
+        return object_bytes((self._stored, self._live, self._native))
+
+    def commit(self, model_name):
+        with self._lock:
+            live = self._live.get(model_name)
+            if live is not None:
+                self._stored[model_name] = live
+
+
+if __name__ == '__main__':
+    # Usage (from the repository root): python codes/forecast_store.py [store_path]
+    store_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_STORE_PATH
+    store = build_forecast_store(ModelRegistry('model'), store_path)
+    print(f"Wrote {store['model_name'].nunique()} forecasts ({len(store)} rows) to {store_path}")
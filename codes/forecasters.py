@@ -0,0 +1,88 @@
+import numpy as np
+
+# Parameter grid searched when fitting a damped trend; small enough to evaluate in one pass
+ALPHA_GRID = np.linspace(0.05, 0.95, 10)
+BETA_GRID = np.linspace(0.05, 0.95, 10)
+PHI_GRID = np.array([0.8, 0.9, 0.95, 0.98, 1.0])
+
+# Series fitted together per block; bounds the (series x parameter grid) working arrays
+PANEL_CHUNK_SIZE = 1024
+
+
+# Move each row's observed values to the front, keeping their order, so every series starts at column 0
+def _left_align(Y):
+    missing = np.isnan(Y)
+    order = np.argsort(missing, axis=1, kind='stable')
+    return np.take_along_axis(Y, order, axis=1), (~missing).sum(axis=1)
+
+
+def _fit_chunk(Y):
+    Y, counts = _left_align(Y)
+    alpha, beta, phi = (grid.ravel() for grid in np.meshgrid(ALPHA_GRID, BETA_GRID, PHI_GRID, indexing='ij'))
+
+    # State arrays are (series, parameter combination); every combination is run side by side
+    level = np.repeat(Y[:, :1], len(alpha), axis=1)
+    first_step = Y[:, 1:2] - Y[:, :1] if Y.shape[1] > 1 else np.zeros_like(Y[:, :1])
+    trend = np.repeat(np.nan_to_num(first_step), len(alpha), axis=1)
+    sse = np.zeros(level.shape)
+    for t in range(1, Y.shape[1]):
+        observed = (t < counts)[:, None]
+        value = Y[:, t:t + 1]
+        one_step = level + phi * trend
+        sse += np.where(observed, (value - one_step) ** 2, 0.0)
+        new_level = alpha * value + (1 - alpha) * one_step
+        new_trend = beta * (new_level - level) + (1 - beta) * phi * trend
+        level = np.where(observed, new_level, level)
+        trend = np.where(observed, new_trend, trend)
+
+    rows = np.arange(len(Y))
+    best = np.argmin(sse, axis=1)
+    params = {
+        'alpha': alpha[best],
+        'beta': beta[best],
+        'phi': phi[best],
+        'level': level[rows, best],
+        'trend': trend[rows, best],
+    }
+
+    # Too short to estimate smoothing weights, so carry the last value and step forward
+    short = counts < 3
+    if short.any():
+        last = Y[rows, np.maximum(counts - 1, 0)]
+        previous = Y[rows, np.maximum(counts - 2, 0)]
+        params['alpha'][short] = 1.0
+        params['beta'][short] = 0.0
+        params['phi'][short] = 1.0
+        params['level'][short] = last[short]
+        params['trend'][short] = np.where(counts == 2, last - previous, 0.0)[short]
+    return params
+
+
+# Fit Holt's additive damped trend to every row of a (series x years) array at once, by grid
+# search on one-step SSE. Missing values (NaN) are skipped; rows with no data give NaN parameters.
+def fit_damped_trend_panel(Y, chunk_size=PANEL_CHUNK_SIZE):
+    Y = np.atleast_2d(np.asarray(Y, dtype='float64'))
+    chunks = [_fit_chunk(Y[start:start + chunk_size]) for start in range(0, len(Y), chunk_size)]
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+# Forecast h steps ahead for every fitted series; returns a (series x h) array
+def forecast_damped_trend_panel(params, h):
+    steps = np.arange(1, h + 1)
+    damping = np.cumsum(params['phi'][:, None] ** steps[None, :], axis=1)
+    return params['level'][:, None] + damping * params['trend'][:, None]
+
+
+# Fit Holt's additive damped trend to a single short annual series.
+# Returns the fitted parameters together with the final level and trend.
+def fit_damped_trend(y):
+    y = np.asarray(y, dtype='float64')
+    if np.isnan(y).all():
+        raise ValueError("Cannot fit a forecaster to an empty series")
+    return {name: value[0] for name, value in fit_damped_trend_panel(y[None, :]).items()}
+
+
+# Forecast h steps ahead from a fitted damped trend
+def forecast_damped_trend(params, h):
+    damping = np.cumsum(params['phi'] ** np.arange(1, h + 1))
+    return params['level'] + damping * params['trend']
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+
+from forecast_store import FORECAST_HORIZON
+from forecasters import fit_damped_trend_panel, forecast_damped_trend_panel
+from history_store import prediction_dates
+from panel_forecast import stack_series
+
+# Aggregate of every bottom-level series
+PORTFOLIO_LABEL = 'All companies'
+
+# Ways of mapping base forecasts to coherent ones; 'wls' weights each series by its forecast variance
+RECONCILIATION_METHODS = ('bottom_up', 'ols', 'structural', 'wls')
+
+
+def company_total_label(company):
+    return f"{company} Total"
+
+
+# Aggregates of a set of '{company} Scope N' series, top down: the portfolio, then each sector when a
+# {company: sector} mapping is given, then each company's Scope 1+2+3 total
+def company_groups(model_names, sectors=None, portfolio_label=PORTFOLIO_LABEL):
+    companies = {}
+    for model_name in model_names:
+        companies.setdefault(model_name.rsplit(' Scope ', 1)[0], []).append(model_name)
+
+    groups = {portfolio_label: list(model_names)}
+    for company, names in companies.items():
+        sector = (sectors or {}).get(company)
+        if sector is not None:
+            groups.setdefault(sector, []).extend(names)
+    groups.update({company_total_label(company): names for company, names in companies.items()})
+    return groups
+
+
+class Hierarchy:
+    """Summing structure of bottom-level series and the aggregates built from them.
+
+    Rows of the summing matrix are the aggregates followed by the bottom series, so any vector of
+    bottom values b gives every level at once as S @ b.
+    """
+
+    def __init__(self, groups, bottom):
+        self.bottom = list(bottom)
+        self.aggregates = list(groups)
+        self.names = self.aggregates + self.bottom
+        position = {name: i for i, name in enumerate(self.bottom)}
+        aggregate_rows = np.zeros((len(self.aggregates), len(self.bottom)))
+        for row, members in enumerate(groups.values()):
+            aggregate_rows[row, [position[name] for name in members]] = 1.0
+        self.summing = np.vstack([aggregate_rows, np.eye(len(self.bottom))])
+
+    @classmethod
+    def for_companies(cls, model_names, sectors=None):
+        return cls(company_groups(model_names, sectors), model_names)
+
+    # Every level of a (bottom series x anything) array, e.g. aggregated histories or forecasts
+    def aggregate(self, bottom_values):
+        return self.summing @ bottom_values
+
+    # (bottom x all series) matrix P mapping base forecasts to coherent bottom forecasts (S @ P @ base).
+    # variances are only used by 'wls'; non-positive or missing ones get the mean of the valid ones.
+    def reconciliation_matrix(self, method='wls', variances=None):
+        S = self.summing
+        if method == 'bottom_up':
+            return np.hstack([np.zeros((len(self.bottom), len(self.aggregates))), np.eye(len(self.bottom))])
+        if method == 'ols':
+            weights = np.ones(len(S))
+        elif method == 'structural':
+            weights = 1.0 / S.sum(axis=1)
+        elif method == 'wls':
+            variances = np.asarray(variances, dtype='float64')
+            valid = np.isfinite(variances) & (variances > 0)
+            variances = np.where(valid, variances, variances[valid].mean() if valid.any() else 1.0)
+            weights = 1.0 / variances
+        else:
+            raise ValueError(f"Unknown reconciliation method {method!r}; expected one of {', '.join(RECONCILIATION_METHODS)}")
+        weighted = S.T * weights
+        return np.linalg.solve(weighted @ S, weighted)
+
+    # Coherent forecasts of every series from a (all series x steps) array of base forecasts, in one product
+    def reconcile(self, base, method='wls', variances=None):
+        return self.summing @ (self.reconciliation_matrix(method, variances) @ base)
+
+
+# Histories of every level aligned on calendar year. An aggregate only has a value in the years where
+# all its members do, so totals never mix complete and partial years.
+def aggregate_histories(hierarchy, history):
+    names, years, panel = stack_series({name: history[name] for name in hierarchy.bottom})
+    observed = ~np.isnan(panel)
+    totals = hierarchy.aggregate(np.where(observed, panel, 0.0))
+    complete = hierarchy.aggregate(observed.astype('float64')) == hierarchy.summing.sum(axis=1)[:, None]
+    return years, np.where(complete, totals, np.nan)
+
+
+# Base forecasts of every level on the calendar years they all cover, and the variance of each series'
+# year-on-year changes (the one-step error of a naive forecast), which weights the 'wls' reconciliation.
+# Bottom series use their model forecasts; aggregates are forecast from their summed histories by the
+# damped trend panel forecaster in one vectorised fit.
+def base_forecasts(hierarchy, forecasts, history, h=FORECAST_HORIZON):
+    years, histories = aggregate_histories(hierarchy, history)
+    variances = np.array([np.var(np.diff(row[~np.isnan(row)]), ddof=1) if (~np.isnan(row)).sum() > 2 else np.nan
+                          for row in histories])
+
+    count = len(hierarchy.aggregates)
+    steps = forecast_damped_trend_panel(fit_damped_trend_panel(histories[:count]), h) if count else np.empty((0, h))
+    rows = {}
+    for name, values, row in zip(hierarchy.aggregates, steps, histories[:count]):
+        observed = pd.DatetimeIndex(pd.to_datetime(years[~np.isnan(row)].astype(str), format='%Y'))
+        rows[name] = pd.Series(values, index=prediction_dates(pd.DataFrame(index=observed), h))
+    for name in hierarchy.bottom:
+        predictions = forecasts[name]['y_pred'].to_numpy(dtype='float64')
+        rows[name] = pd.Series(predictions, index=prediction_dates(history[name], len(predictions)))
+
+    base = pd.DataFrame(rows).T.dropna(axis=1)
+    return base.loc[hierarchy.names], pd.Series(variances, index=hierarchy.names, name='variance')
+
+
+# Coherent forecasts of every series in the hierarchy (rows: aggregates then bottom series, columns: dates)
+def reconciled_forecasts(model_names, forecasts, history, method='wls', sectors=None, h=FORECAST_HORIZON):
+    hierarchy = Hierarchy.for_companies(list(model_names), sectors)
+    base, variances = base_forecasts(hierarchy, forecasts, history, h)
+    coherent = hierarchy.reconcile(base.to_numpy(), method, variances.to_numpy())
+    return pd.DataFrame(coherent, index=base.index, columns=base.columns)
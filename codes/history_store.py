@@ -0,0 +1,171 @@
+import hashlib
+import os
+import re
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from memory_budget import session_view
+from tracing import span
+
+# Historical files are named '<company>_scope<N>.csv', e.g. 'meta_scope1.csv'
+HISTORY_FILE_PATTERN = re.compile(r'^(?P<company>[a-z0-9]+)_scope(?P<scope>\d+)\.csv$')
+
+DEFAULT_STORE_PATH = 'data/history.feather'
+
+# Schema metadata key holding the fingerprint of the CSVs the store was built from
+FINGERPRINT_KEY = b'source_fingerprint'
+
+
+def discover_history_paths(data_dir='data'):
+    history_paths = {}
+    for file_name in sorted(os.listdir(data_dir)):
+        match = HISTORY_FILE_PATTERN.match(file_name)
+        if match is not None:
+            history_paths[(match.group('company').capitalize(), int(match.group('scope')))] = os.path.join(data_dir, file_name)
+    return history_paths
+
+
+# Content fingerprint of every history CSV; file contents rather than mtimes, which a git checkout resets
+def history_fingerprint(history_paths):
+    digest = hashlib.sha256()
+    for path in sorted(history_paths.values()):
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+# Read one 'Year,ScopeN' CSV: strips the BOM and parses the '1/1/YYYY' dates with an explicit format
+def read_history_csv(path):
+    raw = pd.read_csv(path, encoding='utf-8-sig')
+    years = pd.to_datetime(raw['Year'], format='%m/%d/%Y').dt.year
+    return years.to_numpy(dtype='int16'), raw.iloc[:, 1].to_numpy(dtype='float64')
+
+
+# Normalise every history CSV into one long table (company, scope, year, value) sorted by key
+def build_history_table(history_paths):
+    companies, scopes, years, values = [], [], [], []
+    for (company, scope), path in sorted(history_paths.items()):
+        file_years, file_values = read_history_csv(path)
+        order = np.argsort(file_years, kind='stable')
+        companies.extend([company] * len(order))
+        scopes.append(np.full(len(order), scope, dtype='int8'))
+        years.append(file_years[order])
+        values.append(file_values[order])
+
+    table = pa.table({
+        'company': pa.array(companies, type=pa.string()).dictionary_encode(),
+        'scope': pa.array(np.concatenate(scopes) if scopes else np.array([], dtype='int8')),
+        'year': pa.array(np.concatenate(years) if years else np.array([], dtype='int16')),
+        'value': pa.array(np.concatenate(values) if values else np.array([], dtype='float64')),
+    })
+    return table.replace_schema_metadata({FINGERPRINT_KEY: history_fingerprint(history_paths).encode()})
+
+
+# Ingestion step: write the long table as an uncompressed Feather file so it can be memory-mapped.
+# The old file is replaced rather than rewritten, since tables memory-mapped from it (in this or other
+# processes) must keep their values.
+def build_history_store(data_dir='data', store_path=DEFAULT_STORE_PATH):
+    table = build_history_table(discover_history_paths(data_dir))
+    tmp_path = f"{store_path}.{os.getpid()}.tmp"
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, store_path)
+    return table
+
+
+# Dates the charts give to the forecast steps after a historical frame (year ends from its last date)
+def prediction_dates(historical, periods):
+    return pd.date_range(start=historical.index[-1] + pd.DateOffset(1), periods=periods, freq='Y')
+
+
+class HistoryStore:
+    """Historical emissions for every company and scope, read once from a memory-mapped Feather file.
+
+    The store is rebuilt from data/*_scopeN.csv when those files no longer match the fingerprint
+    it was built from. Frames are served by model name ("Meta Scope 1") in the same shape the
+    per-file CSV reads used to return: a 'Year' DatetimeIndex and a single 'ScopeN' column.
+    """
+
+    def __init__(self, data_dir='data', store_path=DEFAULT_STORE_PATH):
+        self.data_dir = data_dir
+        self.store_path = store_path
+        self.table = self._open()
+        self._index = self._build_index(self.table)
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def _open(self):
+        fingerprint = history_fingerprint(discover_history_paths(self.data_dir)).encode()
+        if os.path.exists(self.store_path):
+            table = feather.read_table(self.store_path, memory_map=True)
+            if (table.schema.metadata or {}).get(FINGERPRINT_KEY) == fingerprint:
+                return table
+        with span('history rebuild', data_dir=self.data_dir):
+            try:
+                return build_history_store(self.data_dir, self.store_path)
+            except OSError:
+                # Read-only deployments still work, they just rebuild the table in memory
+                return build_history_table(discover_history_paths(self.data_dir))
+
+    # Row ranges of each (company, scope) block in the sorted table
+    @staticmethod
+    def _build_index(table):
+        companies = table.column('company').to_numpy()
+        scopes = table.column('scope').to_numpy()
+        index = {}
+        if len(scopes) == 0:
+            return index
+        boundaries = np.flatnonzero((companies[1:] != companies[:-1]) | (scopes[1:] != scopes[:-1])) + 1
+        starts = np.concatenate([[0], boundaries])
+        stops = np.concatenate([boundaries, [len(scopes)]])
+        for start, stop in zip(starts, stops):
+            index[f"{companies[start]} Scope {scopes[start]}"] = (start, stop)
+        return index
+
+    def __contains__(self, model_name):
+        return model_name in self._index
+
+    def __getitem__(self, model_name):
+        frame = self._frames.get(model_name)
+        if frame is None:
+            with self._lock:
+                start, stop = self._index[model_name]
+                rows = self.table.slice(start, stop - start)
+                scope = rows.column('scope')[0].as_py()
+                index = pd.DatetimeIndex(pd.to_datetime(rows.column('year').to_numpy().astype('int64').astype(str), format='%Y'), name='Year')
+                frame = pd.DataFrame({f'Scope{scope}': rows.column('value').to_numpy()}, index=index)
+                self._frames[model_name] = frame
+        return session_view(frame)
+
+    # Reopen the table if the CSVs changed since it was built; returns True when it did
+    def refresh(self):
+        table = self._open()
+        if table.schema.metadata.get(FINGERPRINT_KEY) == self.table.schema.metadata.get(FINGERPRINT_KEY):
+            return False
+        index = self._build_index(table)
+        with self._lock:
+            self.table, self._index, self._frames = table, index, {}
+        return True
+
+    def keys(self):
+        return self._index.keys()
+
+    # Fingerprint of the CSVs the table was built from; it changes whenever refresh() picks up new data
+    def fingerprint(self):
+        return self.table.schema.metadata[FINGERPRINT_KEY].decode()
+
+    # Bytes of the table; its pages are mapped from the Feather file and shared with other processes
+    def memory_bytes(self):
+        return self.table.nbytes
+
+
+if __name__ == '__main__':
+    # Usage (from the repository root): python codes/history_store.py [store_path]
+    store_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_STORE_PATH
+    table = build_history_store('data', store_path)
+    print(f"Wrote {table.num_rows} rows for {len(set(zip(table.column('company').to_pylist(), table.column('scope').to_pylist())))} series to {store_path}")
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Ceiling on the stage cache shared by all sessions, in MiB. Parsed uploads, their forecasts and the
+# frames joined with them are the large entries, so they are what least-recently-used eviction drops.
+DEFAULT_CACHE_MB = 256
+
+
+def cache_budget_bytes():
+    return int(float(os.environ.get('CARBONCAST_CACHE_MB', DEFAULT_CACHE_MB)) * 1024 * 1024)
+
+
+# Approximate memory held by an object: exact for pandas, NumPy and Arrow data, recursive for containers,
+# plotly figures and plain objects. Objects reachable twice are only counted once.
+def object_bytes(obj, seen=None):
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(np.sum(obj.memory_usage(deep=True, index=True)))
+    if isinstance(obj, pd.Index):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + (sum(object_bytes(item, seen) for item in obj.flat) if obj.dtype == object else 0)
+    if isinstance(obj, (pa.Table, pa.Array, pa.ChunkedArray, pa.RecordBatch)):
+        return obj.nbytes
+    if isinstance(obj, (bytes, bytearray, str, int, float, bool)) or obj is None:
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(object_bytes(key, seen) + object_bytes(value, seen) for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(object_bytes(item, seen) for item in obj)
+    if hasattr(obj, 'to_plotly_json'):
+        return object_bytes(obj.to_plotly_json(), seen)
+    if hasattr(obj, 'data') and type(obj).__name__ == 'Styler':
+        return object_bytes(obj.data, seen)
+    if hasattr(obj, '__dict__'):
+        return sys.getsizeof(obj) + object_bytes(vars(obj), seen)
+    return sys.getsizeof(obj)
+
+
+# A session's own handle on a shared frame. With pandas copy-on-write a shallow copy shares the data
+# until either side writes to it, so sessions can reshape or modify what they get for free without
+# ever touching the shared original. Other objects are returned as they are.
+def session_view(obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return obj.copy(deep=False)
+    return obj
+
+
+def format_bytes(n):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(n) < 1024:
+            return f"{n:,.1f} {unit}" if unit != 'B' else f"{n:,} B"
+        n /= 1024
+    return f"{n:,.1f} GiB"
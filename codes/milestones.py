@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+# Target years reported next to every chart
+MILESTONE_YEARS = (2030, 2050)
+
+
+# Calendar year of every row, whatever the index holds (timestamps, periods or 'YYYY' strings)
+def index_years(index):
+    if isinstance(index, (pd.DatetimeIndex, pd.PeriodIndex)):
+        return np.asarray(index.year)
+    return np.asarray(pd.to_datetime(index.astype(str), format='mixed').year)
+
+
+# Value of each column at each target year, in one vectorised lookup over a year-indexed array.
+# Uses the last non-missing value within the year, so the historical row and the prediction row of
+# the same year never shadow each other. Defaults to every '... Prediction' column; returns a frame
+# with one row per target year and NaN where a column is missing or has no value for that year.
+def milestone_values(frame, years=MILESTONE_YEARS, columns=None):
+    if columns is None:
+        columns = [column for column in frame.columns if str(column).endswith(' Prediction')]
+    requested = list(columns)
+    columns = [column for column in requested if column in frame.columns]
+    years = np.asarray(list(years))
+    values = frame[columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64')
+    result = np.full((len(years), len(columns)), np.nan)
+    if values.size == 0:
+        return pd.DataFrame(result, index=pd.Index(years, name='Year'), columns=columns).reindex(columns=requested)
+
+    # (rows, years, columns) mask of observed values falling in each target year
+    hits = (index_years(frame.index)[:, None] == years[None, :])[:, :, None] & ~np.isnan(values)[:, None, :]
+    last_row = len(values) - 1 - np.argmax(hits[::-1], axis=0)
+    found = hits.any(axis=0)
+    result[found] = values[last_row, np.arange(len(columns))[None, :]][found]
+    return pd.DataFrame(result, index=pd.Index(years, name='Year'), columns=columns).reindex(columns=requested)
+
+
+def format_milestone(value):
+    return 'Data not available' if pd.isna(value) else f"{value:,.3f}"
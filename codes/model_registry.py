@@ -0,0 +1,117 @@
+import os
+import re
+import threading
+import time
+
+from cold_start import pycaret_time_series
+from memory_budget import object_bytes
+from tracing import span
+
+# Model files are named '<company>_scope<N>_model.pkl', e.g. 'meta_scope1_model.pkl'
+MODEL_FILE_PATTERN = re.compile(r'^(?P<company>[a-z0-9]+)_scope(?P<scope>\d+)_model\.pkl$')
+
+
+# Find every model in the model directory and key it by its display name ("Meta Scope 1")
+def discover_model_paths(model_dir='model'):
+    model_paths = {}
+    for file_name in sorted(os.listdir(model_dir)):
+        match = MODEL_FILE_PATTERN.match(file_name)
+        if match is None:
+            continue
+        model_name = f"{match.group('company').capitalize()} Scope {match.group('scope')}"
+        # load_model appends the '.pkl' extension itself
+        model_paths[model_name] = os.path.join(model_dir, file_name[:-len('.pkl')])
+    return model_paths
+
+
+# (mtime, size) of a model pickle, which changes whenever the file is replaced
+def model_file_key(model_path):
+    stat = os.stat(model_path + '.pkl')
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ModelRegistry:
+    """Process-wide registry that unpickles each model the first time it is asked for.
+
+    The registry is meant to be created once per process (e.g. through st.cache_resource)
+    so every Streamlit session and rerun shares the same loaded models. A model whose
+    pickle has been replaced since it was loaded is unpickled again on its next use.
+    """
+
+    def __init__(self, model_dir='model'):
+        self.model_dir = model_dir
+        self.model_paths = discover_model_paths(model_dir)
+        self._file_keys = {model_name: model_file_key(model_path) for model_name, model_path in self.model_paths.items()}
+        self._models = {}
+        self._load_stats = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, model_name):
+        return model_name in self.model_paths
+
+    def __getitem__(self, model_name):
+        return self.get(model_name)
+
+    def __len__(self):
+        return len(self.model_paths)
+
+    def companies(self):
+        # Keep the order in which companies were discovered, without duplicates
+        return list(dict.fromkeys(name.rsplit(' Scope ', 1)[0] for name in self.model_paths))
+
+    def get(self, model_name):
+        if model_name not in self.model_paths:
+            raise KeyError(model_name)
+        key = model_file_key(self.model_paths[model_name])
+        loaded = self._models.get(model_name)
+        if loaded is not None and loaded[0] == key:
+            return loaded[1]
+
+        # Concurrent sessions must never unpickle the same file twice, and loads are
+        # serialised so the memory measurement only sees this model's allocations
+        with self._lock:
+            loaded = self._models.get(model_name)
+            if loaded is None or loaded[0] != key:
+                loaded = (key, self._load(model_name))
+                self._models[model_name] = loaded
+        return loaded[1]
+
+    # Pick up model files added since the registry was created, e.g. by model selection; returns their names
+    def refresh(self):
+        with self._lock:
+            discovered = discover_model_paths(self.model_dir)
+            file_keys = {model_name: model_file_key(model_path) for model_name, model_path in discovered.items()}
+            replaced = [model_name for model_name, file_key in file_keys.items() if self._file_keys.get(model_name) != file_key]
+            self.model_paths = {**self.model_paths, **discovered}
+            self._file_keys.update(file_keys)
+        return replaced
+
+    # Drop a loaded model so its next use unpickles the file now on disk; that file no longer counts as
+    # replaced for refresh()
+    def evict(self, model_name):
+        with self._lock:
+            self._models.pop(model_name, None)
+            self._file_keys[model_name] = model_file_key(self.model_paths[model_name])
+
+    def _load(self, model_name):
+        model_path = self.model_paths[model_name]
+        # Imported before the clock starts, so the time only covers the unpickle itself
+        load_model = pycaret_time_series().load_model
+
+        start = time.perf_counter()
+        with span('model unpickle', model=model_name):
+            model = load_model(model_path, verbose=False)
+        elapsed = time.perf_counter() - start
+
+        # Size of the loaded pipeline itself; tracing allocations would slow every thread and count
+        # whatever the other threads allocate during the load
+        self._load_stats[model_name] = {
+            'load_seconds': elapsed,
+            'memory_bytes': object_bytes(model),
+            'file_bytes': os.path.getsize(model_path + '.pkl'),
+        }
+        return model
+
+    def load_stats(self):
+        # Copy so callers can render the stats without racing concurrent loads
+        return {model_name: dict(stats) for model_name, stats in self._load_stats.items()}
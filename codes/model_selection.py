@@ -0,0 +1,280 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from forecast_store import DEFAULT_STORE_PATH, run_forecast, update_forecast_store
+from history_store import discover_history_paths
+from native_models import DEFAULT_NATIVE_PATH, export_model, update_native_models
+from retrain_worker import ARTIFACT_DIR, file_hash, load_manifest, record_version, save_artifact, save_manifest, training_series
+
+DEFAULT_LEADERBOARD_PATH = 'model/leaderboard.sqlite'
+
+# One-step-ahead backtests per series, on the most recent years (expanding training window). Series too
+# short for this many after MIN_TRAIN_YEARS get fewer: the shipped six-year CSVs allow three.
+DEFAULT_FOLDS = 5
+
+# Shortest history a candidate is fitted on during the backtest
+MIN_TRAIN_YEARS = 3
+
+# After each fold, candidates whose running MAPE is worse than this multiple of the best are dropped
+EARLY_STOP_RATIO = 3.0
+
+# Folds every candidate runs before any can be dropped, so one noisy year cannot decide on its own
+MIN_FOLDS_BEFORE_STOP = 2
+
+LEADERBOARD_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    folds INTEGER NOT NULL,
+    stop_ratio REAL NOT NULL,
+    candidates TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leaderboard (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    model_name TEXT NOT NULL,
+    candidate TEXT NOT NULL,
+    status TEXT NOT NULL,
+    folds INTEGER NOT NULL,
+    mape_percent REAL,
+    fit_seconds REAL,
+    rank INTEGER,
+    error TEXT,
+    PRIMARY KEY (run_id, model_name, candidate)
+);
+CREATE INDEX IF NOT EXISTS leaderboard_model ON leaderboard (model_name, run_id);
+"""
+
+
+# Candidate forecasters by PyCaret model id, the same families the shipped models were picked from.
+# Each value builds a fresh unfitted forecaster; imported on use so the CLI starts without sktime.
+def candidate_forecasters():
+    from pycaret.containers.models.time_series import BaseCdsDtForecaster
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.linear_model import BayesianRidge, LinearRegression
+    from sktime.forecasting.arima import ARIMA
+    from sktime.forecasting.croston import Croston
+    from sktime.forecasting.ets import AutoETS
+    from sktime.forecasting.exp_smoothing import ExponentialSmoothing
+    from sktime.forecasting.naive import NaiveForecaster
+    from sktime.forecasting.theta import ThetaForecaster
+    from sktime.transformations.series.summarize import WindowSummarizer
+
+    def cds_dt(regressor):
+        return lambda: BaseCdsDtForecaster(regressor=regressor(), window_length=1,
+                                           fe_target_rr=[WindowSummarizer(lag_feature={'lag': [1]}, n_jobs=1)])
+
+    return {
+        'naive': lambda: NaiveForecaster(),
+        'grand_means': lambda: NaiveForecaster(strategy='mean'),
+        'drift': lambda: NaiveForecaster(strategy='drift'),
+        'croston': lambda: Croston(),
+        'theta': lambda: ThetaForecaster(),
+        'exp_smooth': lambda: ExponentialSmoothing(sp=1, trend='add'),
+        'ets': lambda: AutoETS(trend='add'),
+        'arima': lambda: ARIMA(),
+        'lr_cds_dt': cds_dt(LinearRegression),
+        'br_cds_dt': cds_dt(BayesianRidge),
+        'rf_cds_dt': cds_dt(lambda: RandomForestRegressor(random_state=123)),
+    }
+
+
+# The layout of the shipped pickles, which the registry, forecast store and native exporter expect
+def selection_pipeline(forecaster):
+    from sktime.forecasting.compose import ForecastingPipeline, TransformedTargetForecaster
+    return ForecastingPipeline(steps=[('forecaster', TransformedTargetForecaster(steps=[('model', forecaster)]))])
+
+
+# Rolling-origin backtest of every candidate on one series with early stopping. Each fold fits on the
+# years before it and scores the one-step forecast; from MIN_FOLDS_BEFORE_STOP folds on, the clearly
+# losing candidates stop after each fold. Only candidates that ran every fold are ranked.
+# Returns one row per candidate: status (completed, stopped or failed), folds run, MAPE in percent and mean fit time.
+def backtest(y, candidates, folds=DEFAULT_FOLDS, stop_ratio=EARLY_STOP_RATIO):
+    folds = min(folds, len(y) - MIN_TRAIN_YEARS)
+    if folds < 1:
+        raise ValueError(f"need at least {MIN_TRAIN_YEARS + 1} years of history, got {len(y)}")
+
+    scores = {name: {'errors': [], 'fit_seconds': [], 'status': 'completed', 'error': None} for name in candidates}
+    active = list(candidates)
+    for fold, cutoff in enumerate(range(len(y) - folds, len(y)), 1):
+        actual = float(y.iloc[cutoff])
+        for name in active:
+            start = time.perf_counter()
+            try:
+                forecaster = candidates[name]().fit(y.iloc[:cutoff])
+                predicted = float(np.ravel(forecaster.predict(fh=[1]))[0])
+            except Exception as e:
+                scores[name].update(status='failed', error=f"{type(e).__name__}: {e}")
+                continue
+            scores[name]['fit_seconds'].append(time.perf_counter() - start)
+            scores[name]['errors'].append(abs(actual - predicted) / abs(actual) if actual else np.inf)
+
+        active = [name for name in active if scores[name]['status'] != 'failed']
+        if fold < MIN_FOLDS_BEFORE_STOP:
+            continue
+        running = {name: np.mean(scores[name]['errors']) for name in active}
+        best = min(running.values(), default=np.nan)
+        for name in active:
+            if running[name] > best * stop_ratio:
+                scores[name]['status'] = 'stopped'
+        active = [name for name in active if scores[name]['status'] == 'completed']
+
+    rows = []
+    for name, score in scores.items():
+        rows.append({'candidate': name, 'status': score['status'], 'folds': len(score['errors']),
+                     'mape_percent': 100 * float(np.mean(score['errors'])) if score['errors'] else None,
+                     'fit_seconds': float(np.mean(score['fit_seconds'])) if score['fit_seconds'] else None,
+                     'error': score['error']})
+    ranked = sorted((row for row in rows if row['status'] == 'completed'), key=lambda row: (row['mape_percent'], row['fit_seconds']))
+    for rank, row in enumerate(ranked, 1):
+        row['rank'] = rank
+    return rows
+
+
+# Pool task: backtest one series and, when asked, fit the winner on the training window and forecast it.
+# Never raises, so one bad series cannot stop the others.
+def select_series(model_name, scope, csv_path, folds=DEFAULT_FOLDS, stop_ratio=EARLY_STOP_RATIO, candidate_names=None, fit_best=False):
+    start = time.perf_counter()
+    result = {'model_name': model_name, 'rows': [], 'model': None}
+    try:
+        result['data_hash'] = file_hash(csv_path)
+        candidates = candidate_forecasters()
+        if candidate_names:
+            candidates = {name: candidates[name] for name in candidate_names}
+        result['rows'] = backtest(training_series(csv_path, scope, holdout=0), candidates, folds, stop_ratio)
+        winner = next((row for row in result['rows'] if row.get('rank') == 1), None)
+        if fit_best and winner is not None:
+            model = selection_pipeline(candidates[winner['candidate']]()).fit(training_series(csv_path, scope))
+            forecast = run_forecast(model)
+            predictions = forecast.set_index(pd.PeriodIndex(forecast['year'].astype(int), freq='Y'))[['y_pred', 'lower', 'upper']]
+            result.update(model=model, candidate=winner['candidate'], forecast=forecast, native=export_model(model, predictions))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def open_leaderboard(db_path=DEFAULT_LEADERBOARD_PATH):
+    connection = sqlite3.connect(db_path)
+    # Leaderboards from before scores were in percent kept the fraction in a column named mape
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(leaderboard)')]
+    if 'mape' in columns:
+        with connection:
+            connection.execute('ALTER TABLE leaderboard RENAME COLUMN mape TO mape_percent')
+            connection.execute('UPDATE leaderboard SET mape_percent = 100 * mape_percent')
+    connection.executescript(LEADERBOARD_SCHEMA)
+    return connection
+
+
+def record_run(connection, folds, stop_ratio, candidate_names):
+    with connection:
+        cursor = connection.execute('INSERT INTO runs (started_at, folds, stop_ratio, candidates) VALUES (?, ?, ?, ?)',
+                                    (time.strftime('%Y-%m-%dT%H:%M:%S'), folds, stop_ratio, ','.join(candidate_names)))
+    return cursor.lastrowid
+
+
+def record_scores(connection, run_id, model_name, rows):
+    with connection:
+        connection.executemany(
+            'INSERT OR REPLACE INTO leaderboard (run_id, model_name, candidate, status, folds, mape_percent, fit_seconds, rank, error) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(run_id, model_name, row['candidate'], row['status'], row['folds'], row['mape_percent'], row['fit_seconds'], row.get('rank'), row['error'])
+             for row in rows])
+
+
+# Leaderboard of one run (the latest by default), best candidate first within each series
+def read_leaderboard(db_path=DEFAULT_LEADERBOARD_PATH, run_id=None):
+    with sqlite3.connect(db_path) as connection:
+        if run_id is None:
+            run_id = connection.execute('SELECT MAX(run_id) FROM runs').fetchone()[0]
+        return pd.read_sql_query('SELECT * FROM leaderboard WHERE run_id = ? ORDER BY model_name, rank IS NULL, rank, mape_percent',
+                                 connection, params=(run_id,))
+
+
+# Write a selected model as a versioned artifact and make it the live pickle. The retrain manifest records
+# the data it was fitted on, so the retraining worker refits it when that CSV next changes.
+def install_model(result, model_path, artifact_dir=ARTIFACT_DIR):
+    os.makedirs(artifact_dir, exist_ok=True)
+    artifact, model_hash = save_artifact(result['model'], os.path.basename(model_path), artifact_dir)
+    shutil.copyfile(artifact, model_path + '.pkl.tmp')
+    os.replace(model_path + '.pkl.tmp', model_path + '.pkl')
+    manifest = load_manifest(artifact_dir)
+    record_version(manifest, result['model_name'], result['data_hash'], artifact, model_hash)
+    save_manifest(manifest, artifact_dir)
+    return model_hash
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest candidate forecasters for every series in data/ and keep a leaderboard.")
+    parser.add_argument('--companies', nargs='+', help="only these companies (default: every CSV in data/)")
+    parser.add_argument('--candidates', nargs='+', help="only these candidate ids (default: all)")
+    parser.add_argument('--folds', type=int, default=DEFAULT_FOLDS, help="one-step backtest folds per series")
+    parser.add_argument('--stop-ratio', type=float, default=EARLY_STOP_RATIO, help="drop candidates this many times worse than the best")
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help="series backtested in parallel")
+    parser.add_argument('--save', choices=('none', 'new', 'all'), default='new',
+                        help="install the winner for series without a model (new), for every series (all), or not at all")
+    parser.add_argument('--db', default=DEFAULT_LEADERBOARD_PATH, help="SQLite leaderboard file")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--model-dir', default='model', help="where the pickles, versions, stored forecasts and native exports live")
+    args = parser.parse_args()
+
+    series = {f"{company} Scope {scope}": (scope, path) for (company, scope), path in discover_history_paths(args.data_dir).items()
+              if not args.companies or company.lower() in {name.lower() for name in args.companies}}
+    # Everything a run installs goes under one model directory, laid out like the default model/
+    artifact_dir = os.path.join(args.model_dir, os.path.basename(ARTIFACT_DIR))
+    store_path = os.path.join(args.model_dir, os.path.basename(DEFAULT_STORE_PATH))
+    native_path = os.path.join(args.model_dir, os.path.basename(DEFAULT_NATIVE_PATH))
+    model_paths = {name: os.path.join(args.model_dir, f"{name.rsplit(' Scope ', 1)[0].lower()}_scope{scope}_model")
+                   for name, (scope, _) in series.items()}
+    available = list(candidate_forecasters())
+    unknown = sorted(set(args.candidates or []) - set(available))
+    if unknown:
+        parser.error(f"unknown candidate(s) {', '.join(unknown)}; choose from {', '.join(available)}")
+    candidate_names = args.candidates or available
+    tasks = [(name, scope, path, args.folds, args.stop_ratio, candidate_names,
+              args.save == 'all' or (args.save == 'new' and not os.path.exists(model_paths[name] + '.pkl')))
+             for name, (scope, path) in series.items()]
+    if not tasks:
+        print("No series found", file=sys.stderr)
+        return 1
+
+    connection = open_leaderboard(args.db)
+    run_id = record_run(connection, args.folds, args.stop_ratio, candidate_names)
+    installed, failures = {}, 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(min(args.processes, len(tasks))) as pool:
+        for result in pool.starmap(select_series, tasks):
+            record_scores(connection, run_id, result['model_name'], result['rows'])
+            if 'error' in result:
+                failures += 1
+                print(f"FAILED {result['model_name']}: {result['error']}", file=sys.stderr)
+                continue
+            stopped = sum(row['status'] == 'stopped' for row in result['rows'])
+            winner = next((row for row in result['rows'] if row.get('rank') == 1), None)
+            best = f"{winner['candidate']} (MAPE {winner['mape_percent']:.1f}%)" if winner else 'none'
+            print(f"{result['model_name']}: best {best}, {stopped} stopped early, {result['seconds']:.2f} s")
+            if result['model'] is not None:
+                model_hash = install_model(result, model_paths[result['model_name']], artifact_dir)
+                installed[result['model_name']] = (model_hash, result)
+    connection.close()
+
+    if installed:
+        update_forecast_store({name: (model_hash, result['forecast']) for name, (model_hash, result) in installed.items()}, store_path)
+        update_native_models({name: {'model_hash': model_hash, **result['native']} for name, (model_hash, result) in installed.items()},
+                             native_path)
+        for name, (_, result) in installed.items():
+            print(f"Installed {result['candidate']} as {model_paths[name]}.pkl")
+    print(f"Run {run_id}: {len(tasks)} series in {time.perf_counter() - start:.2f} s; leaderboard in {args.db}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    # Usage (from the repository root): python codes/model_selection.py [--save new] [--companies Acme]
+    sys.exit(main())
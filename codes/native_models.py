@@ -0,0 +1,324 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from forecasters import forecast_damped_trend
+
+DEFAULT_NATIVE_PATH = 'model/native_models.json'
+
+# Native forecasts must match predict_model to within this (predict_model rounds to 4 decimals)
+DEFAULT_TOLERANCE = {'rtol': 1e-6, 'atol': 1e-3}
+
+
+class UnsupportedModel(Exception):
+    """The fitted pipeline has no native form; it is exported as a table of its forecasts instead."""
+
+
+# ---------------------------------------------------------------------------------------------------
+# Serving: pure NumPy, no PyCaret, sktime or scikit-learn needed
+
+# Residual regressor of a detrended recursive model, evaluated on the previous residual
+def _regress(regressor, x):
+    if regressor['type'] == 'linear':
+        return regressor['intercept'] + regressor['coef'] * x
+    # Piecewise constant (tree ensembles): trees compare float32 inputs with 'x <= threshold'
+    thresholds = np.asarray(regressor['thresholds'])
+    return regressor['values'][int(np.searchsorted(thresholds, np.float32(x), side='left'))]
+
+
+# Point forecast for steps 1..h of an exported model
+def native_point_forecast(spec, h):
+    params = spec['params']
+    kind = spec['kind']
+    if kind == 'damped_trend':
+        return np.asarray(forecast_damped_trend(params, h), dtype='float64')
+    if kind == 'ar':
+        history = list(params['last'])
+        coefs = np.asarray(params['ar'])
+        y_pred = np.empty(h)
+        for step in range(h):
+            y_pred[step] = params['intercept'] + coefs @ np.asarray(history[len(history) - len(coefs):][::-1])
+            history.append(y_pred[step])
+        return y_pred
+    if kind == 'detrended_recursive':
+        residual = params['last_residual']
+        y_pred = np.empty(h)
+        for step in range(1, h + 1):
+            residual = _regress(params['regressor'], residual)
+            y_pred[step - 1] = params['trend_intercept'] + params['trend_slope'] * step + residual
+        return y_pred
+    if kind == 'table':
+        table = np.asarray(params['y_pred'], dtype='float64')
+        return np.concatenate([table[:h], np.full(max(h - len(table), 0), np.nan)])
+    raise ValueError(f"Unknown native model kind: {kind}")
+
+
+# Forecast in the shape ForecastStore serves (y_pred, lower, upper on an annual PeriodIndex). Intervals
+# are tabulated offsets from the export, so steps beyond the exported horizon have NaN bounds.
+def native_forecast(spec, h):
+    y_pred = native_point_forecast(spec, h)
+    index = pd.period_range(start=pd.Period(spec['cutoff'] + 1, freq='Y'), periods=h, freq='Y')
+    predictions = pd.DataFrame({'y_pred': y_pred, 'lower': np.nan, 'upper': np.nan}, index=index)
+    for bound in ('lower', 'upper'):
+        offsets = np.asarray(spec['interval_offsets'][bound], dtype='float64')[:h]
+        predictions.iloc[:len(offsets), predictions.columns.get_loc(bound)] = y_pred[:len(offsets)] + offsets
+    return predictions
+
+
+def load_native_models(native_path=DEFAULT_NATIVE_PATH):
+    if not os.path.exists(native_path):
+        return {}
+    with open(native_path) as f:
+        return json.load(f)
+
+
+# ---------------------------------------------------------------------------------------------------
+# Export: reads the fitted state of each PyCaret/sktime pipeline, so it needs the training stack
+
+def _final_forecaster(pipeline):
+    if len(pipeline.steps_) != 1:
+        raise UnsupportedModel("pipeline has transformers")
+    steps = pipeline.steps_[-1][1].steps_
+    if len(steps) != 1:
+        raise UnsupportedModel("target transformers")
+    return steps[0][1]
+
+
+def _damped_trend(level, trend=0.0, phi=1.0):
+    return 'damped_trend', {'level': float(level), 'trend': float(trend), 'phi': float(phi)}
+
+
+def _export_naive(forecaster):
+    y = np.asarray(forecaster._y, dtype='float64').ravel()
+    if forecaster.sp != 1 or forecaster.window_length is not None:
+        raise UnsupportedModel("seasonal or windowed naive")
+    if forecaster.strategy == 'last':
+        return _damped_trend(y[-1])
+    if forecaster.strategy == 'mean':
+        return _damped_trend(y.mean())
+    if forecaster.strategy == 'drift':
+        return _damped_trend(y[-1], (y[-1] - y[0]) / (len(y) - 1))
+    raise UnsupportedModel(f"naive strategy {forecaster.strategy}")
+
+
+def _export_croston(forecaster):
+    return _damped_trend(np.asarray(forecaster._f).ravel()[-1])
+
+
+# Theta: SES level plus a drift that is linear in the step (sktime ThetaForecaster._compute_drift)
+def _export_theta(forecaster):
+    if forecaster.sp != 1:
+        raise UnsupportedModel("seasonal theta")
+    level = forecaster._fitted_forecaster.level[-1]
+    alpha = forecaster.initial_level_
+    if np.isclose(alpha, 0.0):
+        return _damped_trend(level, forecaster.trend_)
+    n_timepoints = len(forecaster._y)
+    return _damped_trend(level + forecaster.trend_ * (1 - (1 - alpha) ** n_timepoints) / alpha, forecaster.trend_)
+
+
+def _export_exponential_smoothing(forecaster):
+    if forecaster.seasonal is not None:
+        raise UnsupportedModel("seasonal exponential smoothing")
+    fitted = forecaster._fitted_forecaster
+    trend = fitted.trend[-1] if forecaster.trend is not None else 0.0
+    phi = fitted.params['damping_trend'] if forecaster.damped_trend else 1.0
+    return _damped_trend(fitted.level[-1], trend, phi)
+
+
+def _export_auto_ets(forecaster):
+    if forecaster.auto or forecaster.seasonal is not None or forecaster.trend == 'mul':
+        raise UnsupportedModel("automatic, seasonal or multiplicative-trend ETS")
+    fitted = forecaster._fitted_forecaster
+    state = fitted.states.iloc[-1]
+    trend = state['trend'] if forecaster.trend is not None else 0.0
+    phi = fitted.damping_trend if forecaster.damped_trend else 1.0
+    return _damped_trend(state['level'], trend, phi)
+
+
+# Pure AR(p) with an intercept: y_t = c + sum(phi_i * y_{t-i}), as statsmodels' SARIMAX forecasts it
+def _export_arima(forecaster):
+    p, d, q = forecaster.order
+    if d != 0 or q != 0 or any(forecaster.seasonal_order[:3]) or forecaster._forecaster.arima_res_.model.k_exog:
+        raise UnsupportedModel("differenced, moving-average, seasonal or exogenous ARIMA")
+    params = forecaster._forecaster.arima_res_.params
+    y = np.asarray(forecaster._y, dtype='float64').ravel()
+    return 'ar', {
+        'intercept': float(params.get('intercept', 0.0)),
+        'ar': [float(params[f'ar.L{lag}']) for lag in range(1, p + 1)],
+        'last': y[-max(p, 1):].tolist(),
+    }
+
+
+# Every tree in a fitted single-feature tree model or ensemble
+def _trees(estimator):
+    if hasattr(estimator, 'tree_'):
+        return [estimator]
+    return [tree for tree in np.ravel(getattr(estimator, 'estimators_', [])) if hasattr(tree, 'tree_')]
+
+
+def _export_regressor(estimator):
+    from sklearn.linear_model._base import LinearModel
+
+    if getattr(estimator, 'n_features_in_', None) != 1:
+        raise UnsupportedModel("residual regressor uses more than one lag")
+    if isinstance(estimator, LinearModel):
+        return {'type': 'linear', 'coef': float(np.ravel(estimator.coef_)[0]), 'intercept': float(estimator.intercept_)}
+
+    trees = _trees(estimator)
+    if not trees:
+        raise UnsupportedModel(f"regressor {type(estimator).__name__}")
+    # One feature, so the ensemble is a step function of it: tabulate one value per interval between
+    # split thresholds, evaluated at the largest float32 inside each (threshold[k-1], threshold[k]]
+    thresholds = np.unique(np.concatenate([tree.tree_.threshold[tree.tree_.feature >= 0] for tree in trees]))
+    points = thresholds.astype('float32')
+    points = np.where(points > thresholds, np.nextafter(points, np.float32(-np.inf)), points)
+    above = np.nextafter(np.float32(thresholds[-1]), np.float32(np.inf)) if len(thresholds) else np.float32(0)
+    points = np.append(points, above).astype('float32')
+    return {'type': 'table', 'thresholds': thresholds.tolist(), 'values': estimator.predict(points[:, None].astype('float64')).tolist()}
+
+
+# PyCaret's conditional-deseasonalise + detrend + recursive regression on the previous residual
+def _export_cds_dt(forecaster):
+    from sktime.forecasting.base import ForecastingHorizon
+
+    steps = dict(forecaster._forecaster.steps_)
+    if getattr(steps['conditional_deseasonalise'], 'is_seasonal_', False) or forecaster.degree != 1:
+        raise UnsupportedModel("seasonal or non-linear trend reduction")
+    recursive = steps['forecast']
+    if recursive.window_length_ != 1:
+        raise UnsupportedModel("residual regressor uses more than one lag")
+
+    # Linear trend, read back as its value at steps 1 and 2 after the cutoff
+    trend_1, trend_2 = np.ravel(steps['detrend'].forecaster_.predict(fh=ForecastingHorizon([1, 2], is_relative=True)))
+    return 'detrended_recursive', {
+        'trend_intercept': float(2 * trend_1 - trend_2),
+        'trend_slope': float(trend_2 - trend_1),
+        'last_residual': float(np.asarray(recursive._y, dtype='float64').ravel()[-1]),
+        'regressor': _export_regressor(recursive.estimator_),
+    }
+
+
+EXPORTERS = {
+    'NaiveForecaster': _export_naive,
+    'Croston': _export_croston,
+    'ThetaForecaster': _export_theta,
+    'ExponentialSmoothing': _export_exponential_smoothing,
+    'AutoETS': _export_auto_ets,
+    'ARIMA': _export_arima,
+    'BaseCdsDtForecaster': _export_cds_dt,
+}
+
+
+# Native spec of one fitted pipeline. Models without a native form keep their tabulated forecast.
+def export_model(pipeline, predictions):
+    source = type(pipeline).__name__
+    try:
+        forecaster = _final_forecaster(pipeline)
+        source = type(forecaster).__name__
+        if source not in EXPORTERS:
+            raise UnsupportedModel(source)
+        kind, params = EXPORTERS[source](forecaster)
+    except UnsupportedModel as e:
+        kind, params = 'table', {'y_pred': predictions['y_pred'].tolist(), 'reason': str(e)}
+
+    y_pred = predictions['y_pred'].to_numpy(dtype='float64')
+    return {
+        'source': source,
+        'kind': kind,
+        'params': params,
+        'cutoff': int(predictions.index[0].year) - 1,
+        'interval_offsets': {bound: (predictions[bound].to_numpy(dtype='float64') - y_pred).tolist() for bound in ('lower', 'upper')},
+    }
+
+
+# Write through a temporary file, unique to this process, so readers and other writers never see a
+# half-written file
+def _write_exports(exports, native_path):
+    tmp_path = f"{native_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(exports, f, indent=1)
+    os.replace(tmp_path, native_path)
+    return exports
+
+
+# Export every model of a registry to one JSON file, each entry tied to the hash of its pickle
+def build_native_models(registry, native_path=DEFAULT_NATIVE_PATH):
+    from forecast_store import model_file_hash, run_forecast
+
+    exports = {}
+    for model_name, model_path in registry.model_paths.items():
+        forecast = run_forecast(registry[model_name])
+        predictions = forecast.set_index(pd.PeriodIndex(forecast['year'].astype(int), freq='Y'))[['y_pred', 'lower', 'upper']]
+        exports[model_name] = {'model_hash': model_file_hash(model_path), **export_model(registry[model_name], predictions)}
+    return _write_exports(exports, native_path)
+
+
+# Replace the exports of some models ({model_name: export}), keeping every other entry
+def update_native_models(updates, native_path=DEFAULT_NATIVE_PATH):
+    return _write_exports({**load_native_models(native_path), **updates}, native_path)
+
+
+# Compare every native forecast with predict_model on the original pipeline
+def verify_native_models(registry, exports, fh=30, tolerance=DEFAULT_TOLERANCE):
+    from cold_start import pycaret_time_series
+
+    predict_model = pycaret_time_series().predict_model
+    rows = []
+    for model_name, spec in exports.items():
+        start = time.perf_counter()
+        expected = predict_model(registry[model_name], fh=fh)
+        predict_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        native_point_forecast(spec, fh)
+        native_seconds = time.perf_counter() - start
+        actual = native_forecast(spec, fh)
+
+        y_expected = expected['y_pred'].to_numpy(dtype='float64')
+        y_actual = actual['y_pred'].to_numpy()
+        error = np.abs(y_actual - y_expected)
+        rows.append({
+            'model': model_name,
+            'source': spec['source'],
+            'kind': spec['kind'],
+            'max_abs_error': float(error.max()),
+            'max_rel_error': float((error / np.maximum(np.abs(y_expected), 1e-12)).max()),
+            'same_years': bool((actual.index.year == expected.index.year).all()),
+            'ok': bool(np.allclose(y_actual, y_expected, **tolerance) and (actual.index.year == expected.index.year).all()),
+            'predict_model_ms': predict_seconds * 1000,
+            'native_us': native_seconds * 1e6,
+            'pickle_bytes': os.path.getsize(registry.model_paths[model_name] + '.pkl'),
+            'native_bytes': len(json.dumps(spec)),
+        })
+    return pd.DataFrame(rows).set_index('model')
+
+
+def main():
+    from model_registry import ModelRegistry
+
+    parser = argparse.ArgumentParser(description="Export every model to a native NumPy form and verify it against predict_model.")
+    parser.add_argument('--model-dir', default='model', help="directory of <company>_scope<N>_model.pkl files")
+    parser.add_argument('-o', '--output', default=DEFAULT_NATIVE_PATH, help="JSON file to write")
+    parser.add_argument('--verify-only', action='store_true', help="verify an existing export instead of writing one")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.model_dir)
+    exports = load_native_models(args.output) if args.verify_only else build_native_models(registry, args.output)
+    report = verify_native_models(registry, exports)
+    pd.set_option('display.width', 200)
+    print(report.to_string(float_format='{:,.4g}'.format))
+    failed = report.index[~report['ok']].tolist()
+    print(f"\n{len(report) - len(failed)} of {len(report)} models reproduce predict_model"
+          + (f"; failed: {', '.join(failed)}" if failed else "") + f" ({args.output})")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    # Usage (from the repository root): python codes/native_models.py [--verify-only]
+    sys.exit(main())
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from forecasters import fit_damped_trend_panel, forecast_damped_trend_panel
+
+
+# Stack annual series into one (series x years) array aligned on calendar year, NaN where a
+# series has no value. Accepts a dict of name -> Series or single-column DataFrame with a date index.
+def stack_series(series):
+    names = list(series)
+    values = [np.asarray(series[name], dtype='float64').ravel() for name in names]
+    value_years = [pd.DatetimeIndex(series[name].index).year.to_numpy() for name in names]
+    years = np.unique(np.concatenate(value_years)) if names else np.array([], dtype=int)
+
+    panel = np.full((len(names), len(years)), np.nan)
+    for row, (row_years, row_values) in enumerate(zip(value_years, values)):
+        panel[row, np.searchsorted(years, row_years)] = row_values
+    return names, years, panel
+
+
+# Forecast h years ahead for every series in one pass. Returns a (series x step) frame of forecasts
+# and the last observed year of each series (step 1 is the year after it).
+def forecast_panel(series, h=30):
+    names, years, panel = stack_series(series)
+    params = fit_damped_trend_panel(panel)
+    forecasts = forecast_damped_trend_panel(params, h)
+
+    observed = ~np.isnan(panel)
+    last_column = panel.shape[1] - 1 - np.argmax(observed[:, ::-1], axis=1)
+    last_years = pd.Series(np.where(observed.any(axis=1), years[last_column], -1), index=names, name='last_year')
+    return pd.DataFrame(forecasts, index=names, columns=pd.RangeIndex(1, h + 1, name='step')), last_years
@@ -0,0 +1,248 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+import time
+import traceback
+
+import joblib
+import pandas as pd
+
+from cold_start import pycaret_time_series
+from forecast_store import DEFAULT_STORE_PATH, model_file_hash, run_forecast, update_forecast_store
+from history_store import discover_history_paths, read_history_csv
+from native_models import DEFAULT_NATIVE_PATH, export_model, update_native_models
+
+# Every refit is kept here as '<company>_scope<N>_model.<timestamp>.<hash>.pkl', next to a manifest
+# recording which data each version was fitted on
+ARTIFACT_DIR = 'model/versions'
+MANIFEST_NAME = 'manifest.json'
+
+# Seconds between checks of data/ when the worker runs in the background
+DEFAULT_INTERVAL = 60
+
+# The shipped models were fitted without the latest year (PyCaret's one-year test split), which is why
+# their first forecast step is the last historical year. Refits keep that window so the charts line up.
+TRAINING_HOLDOUT = 1
+
+# Retrain outcomes kept for display in the app
+MAX_RESULTS = 50
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# Content hash of each history CSV, by model name
+def data_hashes(data_dir='data'):
+    return {f"{company} Scope {scope}": (path, file_hash(path)) for (company, scope), path in discover_history_paths(data_dir).items()}
+
+
+def load_manifest(artifact_dir=ARTIFACT_DIR):
+    path = os.path.join(artifact_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, artifact_dir=ARTIFACT_DIR):
+    path = os.path.join(artifact_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+# Note in the manifest that model_name's live model (model_hash, kept as artifact) was fitted on the CSV with data_hash
+def record_version(manifest, model_name, data_hash, artifact, model_hash):
+    manifest.setdefault(model_name, []).append({'data_hash': data_hash, 'artifact': artifact, 'model_hash': model_hash,
+                                                'trained_at': time.strftime('%Y-%m-%dT%H:%M:%S')})
+
+
+# Annual training series in the shape the pipelines were fitted on: 'ScopeN' values on a yearly PeriodIndex
+def training_series(csv_path, scope, holdout=TRAINING_HOLDOUT):
+    years, values = read_history_csv(csv_path)
+    y = pd.Series(values, index=pd.PeriodIndex(years, freq='Y', name='Year'), name=f'Scope{scope}').sort_index()
+    return y.iloc[:len(y) - holdout] if holdout else y
+
+
+# Write a fitted pipeline as a new versioned artifact; returns its path and content hash
+def save_artifact(model, stem, artifact_dir=ARTIFACT_DIR):
+    tmp_path = os.path.join(artifact_dir, f".{stem}.{os.getpid()}.tmp")
+    joblib.dump(model, tmp_path)
+    with open(tmp_path, 'rb') as f:
+        model_hash = hashlib.sha256(f.read()).hexdigest()
+    artifact = os.path.join(artifact_dir, f"{stem}.{time.strftime('%Y%m%dT%H%M%S')}.{model_hash[:12]}.pkl")
+    os.replace(tmp_path, artifact)
+    return artifact, model_hash
+
+
+# Pool task: refit one model's pipeline on its current CSV, forecast it and export it. The current pickle
+# is the template, so the algorithm and its settings stay the ones chosen at training time and only the
+# fitted parameters change. Never raises, so one bad series cannot stop the others.
+def refit_task(model_name, scope, csv_path, model_path, artifact_dir=ARTIFACT_DIR, holdout=TRAINING_HOLDOUT):
+    start = time.perf_counter()
+    try:
+        template = pycaret_time_series().load_model(model_path, verbose=False)
+        model = template.clone().fit(training_series(csv_path, scope, holdout))
+        forecast = run_forecast(model)
+        predictions = forecast.set_index(pd.PeriodIndex(forecast['year'].astype(int), freq='Y'))[['y_pred', 'lower', 'upper']]
+        native = export_model(model, predictions)
+        artifact, model_hash = save_artifact(model, os.path.basename(model_path), artifact_dir)
+    except Exception as e:
+        return {'model_name': model_name, 'status': 'failed', 'error': f"{type(e).__name__}: {e}",
+                'detail': traceback.format_exc(), 'seconds': time.perf_counter() - start}
+    return {'model_name': model_name, 'status': 'refitted', 'artifact': artifact, 'model_hash': model_hash,
+            'forecast': forecast, 'native': native, 'seconds': time.perf_counter() - start}
+
+
+class RetrainWorker:
+    """Refits the models whose history CSVs changed and swaps them into a running process.
+
+    Changed series are found by content hash against the manifest, refitted in a process pool, and
+    written as versioned artifacts. Each new forecast is staged in the forecast store before the
+    model file is atomically replaced, so requests see either the old model and forecast or the new
+    ones. Only the changed models' rows of the forecast store and native exports are rewritten;
+    everything downstream (stage cache, scenarios) is keyed on model hashes and follows by itself.
+    """
+
+    def __init__(self, registry, forecasts, history, data_dir='data', artifact_dir=ARTIFACT_DIR, processes=None,
+                 store_path=DEFAULT_STORE_PATH, native_path=DEFAULT_NATIVE_PATH):
+        self.registry = registry
+        self.forecasts = forecasts
+        self.history = history
+        self.data_dir = data_dir
+        self.artifact_dir = artifact_dir
+        self.processes = processes or os.cpu_count()
+        self.store_path = store_path
+        self.native_path = native_path
+        self.results = []
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Series whose CSV differs from the data their current model was fitted on. Series seen for the
+    # first time are recorded as they are, since the shipped models were fitted on the shipped data.
+    # A series that failed or has no model is not tried again until its CSV changes again.
+    def changed_series(self, manifest, hashes):
+        changed = []
+        for model_name, (path, data_hash) in hashes.items():
+            if self._failed.get(model_name) == data_hash:
+                continue
+            model_path = self.registry.model_paths.get(model_name)
+            versions = manifest.get(model_name)
+            if not versions and model_path is not None:
+                manifest[model_name] = [{'data_hash': data_hash, 'artifact': None, 'model_hash': model_file_hash(model_path), 'trained_at': None}]
+            elif not versions or versions[-1]['data_hash'] != data_hash:
+                changed.append(model_name)
+        return changed
+
+    # Check data/ once and retrain whatever changed; returns the outcome of each changed series
+    def poll(self):
+        with self._lock:
+            os.makedirs(self.artifact_dir, exist_ok=True)
+            # Models installed or replaced since the last poll (e.g. by model_selection.py) may come with
+            # new history, and deserve another try if their series failed before
+            replaced = self.registry.refresh()
+            for model_name in replaced:
+                self._failed.pop(model_name, None)
+            if replaced:
+                self.history.refresh()
+            manifest = load_manifest(self.artifact_dir)
+            hashes = data_hashes(self.data_dir)
+            changed = self.changed_series(manifest, hashes)
+            results = self._retrain(changed, hashes, manifest) if changed else []
+            save_manifest(manifest, self.artifact_dir)
+            self.results = (self.results + results)[-MAX_RESULTS:]
+            return results
+
+    def _retrain(self, changed, hashes, manifest):
+        tasks, results = [], []
+        for model_name in changed:
+            model_path = self.registry.model_paths.get(model_name)
+            if model_path is None:
+                results.append({'model_name': model_name, 'status': 'skipped', 'error': "no model to refit; select one with codes/model_selection.py"})
+                self._failed[model_name] = hashes[model_name][1]
+                continue
+            scope = int(model_name.rsplit(' Scope ', 1)[1])
+            tasks.append((model_name, scope, hashes[model_name][0], model_path, self.artifact_dir))
+
+        if tasks:
+            # spawn rather than fork: the app process runs server threads that must not be copied mid-operation
+            with multiprocessing.get_context('spawn').Pool(min(self.processes, len(tasks))) as pool:
+                refits = pool.starmap(refit_task, tasks)
+            # History first: stages cached on the old model hashes may pair them with the new data,
+            # but are never looked up again once the models below are swapped
+            self.history.refresh()
+            for result in refits:
+                if result['status'] == 'refitted':
+                    self._promote(result)
+                    record_version(manifest, result['model_name'], hashes[result['model_name']][1], result['artifact'], result['model_hash'])
+                else:
+                    self._failed[result['model_name']] = hashes[result['model_name']][1]
+            refitted = [result for result in refits if result['status'] == 'refitted']
+            if refitted:
+                update_forecast_store({result['model_name']: (result['model_hash'], result['forecast']) for result in refitted}, self.store_path)
+                update_native_models({result['model_name']: {'model_hash': result['model_hash'], **result['native']} for result in refitted},
+                                     self.native_path)
+            results.extend(refits)
+        return [{key: value for key, value in result.items() if key not in ('forecast', 'native')} for result in results]
+
+    # Stage the new forecast, then atomically replace the live pickle with a copy of the artifact
+    def _promote(self, result):
+        model_name = result['model_name']
+        model_path = self.registry.model_paths[model_name] + '.pkl'
+        self.forecasts.stage(model_name, result['model_hash'], result['forecast'], result['native'])
+        shutil.copyfile(result['artifact'], model_path + '.tmp')
+        os.replace(model_path + '.tmp', model_path)
+        self.forecasts.commit(model_name)
+        self.registry.evict(model_name)
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                self.results = (self.results + [{'model_name': None, 'status': 'failed', 'error': f"{type(e).__name__}: {e}"}])[-MAX_RESULTS:]
+            self._stop.wait(interval)
+
+    # Poll in a daemon thread of the current process (e.g. the Streamlit server). Calling it again is a no-op.
+    def start(self, interval=DEFAULT_INTERVAL):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='retrain-worker', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    from forecast_service import get_forecast_store, get_history_store, get_model_registry
+
+    parser = argparse.ArgumentParser(description="Refit the models whose history CSVs in data/ changed, and swap them in.")
+    parser.add_argument('--interval', type=float, help="keep watching data/, checking every INTERVAL seconds")
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help="models refitted in parallel")
+    args = parser.parse_args()
+
+    worker = RetrainWorker(get_model_registry(), get_forecast_store(), get_history_store(), processes=args.processes)
+    while True:
+        for result in worker.poll():
+            if result['status'] == 'refitted':
+                print(f"{result['model_name']}: refitted in {result['seconds']:.2f} s -> {result['artifact']}")
+            else:
+                print(f"{result['status'].upper()} {result['model_name']}: {result['error']}", file=sys.stderr)
+        if args.interval is None:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    # Usage (from the repository root): python codes/retrain_worker.py [--interval 60]
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import threading
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from forecast_store import INTERVAL_COVERAGE
+from history_store import prediction_dates
+from milestones import MILESTONE_YEARS, index_years
+
+# Simulated trajectories per (company, scope); enough for stable 5th/95th percentiles
+SCENARIO_DRAWS = 5000
+
+# Bands drawn in the fan charts, from the outer band inwards, plus the median
+FAN_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Emissions at risk: how far the RISK_LEVEL quantile lies above the median in a target year
+RISK_LEVEL = 0.95
+
+
+# Standard deviation of each forecast step. Taken from the model's prediction interval when it has one;
+# otherwise from the year-on-year changes of its history, growing like a random walk (sqrt of the step).
+def step_sigmas(predictions, historical, coverage=INTERVAL_COVERAGE):
+    width = (predictions['upper'] - predictions['lower']).to_numpy(dtype='float64')
+    if np.isfinite(width).all():
+        return width / (2 * NormalDist().inv_cdf(0.5 + coverage / 2)), 'model interval'
+    changes = np.diff(historical.iloc[:, 0].to_numpy(dtype='float64'))
+    scale = np.std(changes, ddof=1) if len(changes) > 1 else abs(changes[0]) if len(changes) else 0.0
+    return scale * np.sqrt(np.arange(1, len(width) + 1)), 'history'
+
+
+class ScenarioEngine:
+    """Monte Carlo trajectories around each model's forecast, simulated once per model file and cached.
+
+    Each trajectory is the point forecast plus a scaled random walk, normalised so that every year's
+    spread matches the step's standard deviation while consecutive years stay correlated. Draws for a
+    model are seeded from the hash of its file, so they are reproducible and independent of which
+    other models are simulated alongside it. Cached arrays are shared and must not be modified.
+    """
+
+    def __init__(self, forecasts, history, draws=SCENARIO_DRAWS, seed=0):
+        self.forecasts = forecasts
+        self.history = history
+        self.draws = draws
+        self.seed = seed
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    # (draws x steps) trajectories of one model, the dates the charts give its steps, and the sigma source
+    def simulate(self, model_name):
+        model_hash = self.forecasts.model_hash(model_name)
+        # The history sets the sigmas and dates, so new data invalidates a model's paths as well
+        version = (model_hash, self.history.fingerprint())
+        cached = self._paths.get(model_name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            cached = self._paths.get(model_name)
+            if cached is None or cached[0] != version:
+                predictions = self.forecasts[model_name]
+                historical = self.history[model_name]
+                sigmas, source = step_sigmas(predictions, historical)
+                steps = len(predictions)
+
+                # One batched draw of every trajectory: cumulative shocks / sqrt(step) has unit variance per step
+                rng = np.random.default_rng([self.seed, int(model_hash[:16], 16)])
+                walk = np.cumsum(rng.standard_normal((self.draws, steps)), axis=1) / np.sqrt(np.arange(1, steps + 1))
+                paths = predictions['y_pred'].to_numpy(dtype='float64') + walk * sigmas
+
+                cached = (version, (paths, prediction_dates(historical, steps), source))
+                self._paths[model_name] = cached
+        return cached[1]
+
+    # Quantile bands of several models at once: {model_name: frame of dates x quantiles}
+    def fan(self, model_names, quantiles=FAN_QUANTILES):
+        simulations = [self.simulate(model_name) for model_name in model_names]
+        if not simulations:
+            return {}
+        steps = min(len(dates) for _, dates, _ in simulations)
+        bands = np.quantile(np.stack([paths[:, :steps] for paths, _, _ in simulations]), quantiles, axis=1)
+        return {model_name: pd.DataFrame(bands[:, i, :].T, index=dates[:steps], columns=list(quantiles))
+                for i, (model_name, (_, dates, _)) in enumerate(zip(model_names, simulations))}
+
+    # Median, mean, RISK_LEVEL quantile and emissions at risk (quantile minus median) in each target year,
+    # per model and for the sum of the models ('Total'), which needs the joint trajectories
+    def emissions_at_risk(self, model_names, years=MILESTONE_YEARS, level=RISK_LEVEL, total_label='Total'):
+        years = list(years)
+        values = []
+        for model_name in model_names:
+            paths, dates, _ = self.simulate(model_name)
+            path_years = index_years(dates)
+            columns = [np.flatnonzero(path_years == year) for year in years]
+            values.append(np.stack([paths[:, found[-1]] if len(found) else np.full(len(paths), np.nan) for found in columns], axis=1))
+
+        labels = list(model_names)
+        if len(values) > 1:
+            values.append(np.sum(values, axis=0))
+            labels.append(total_label)
+        stacked = np.stack(values)  # (series, draws, years)
+
+        median = np.median(stacked, axis=1)
+        upper = np.quantile(stacked, level, axis=1)
+        rows = pd.MultiIndex.from_product([labels, years], names=['series', 'year'])
+        return pd.DataFrame({
+            'median': median.ravel(),
+            'mean': stacked.mean(axis=1).ravel(),
+            f'p{level * 100:g}': upper.ravel(),
+            'emissions_at_risk': (upper - median).ravel(),
+        }, index=rows)
+
+    def memory_bytes(self):
+        return sum(paths.nbytes for _, (paths, _, _) in list(self._paths.values()))
+
+    def sigma_source(self, model_name):
+        return self.simulate(model_name)[2]
@@ -0,0 +1,101 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from memory_budget import object_bytes, session_view
+from tracing import span
+
+# Enough for every company, comparison set and a few dozen uploads without growing unbounded
+DEFAULT_MAX_ENTRIES = 512
+
+
+class StageCache:
+    """Process-wide memo of pipeline stage results, keyed on each stage's actual inputs.
+
+    Results are shared by every session, so callers must treat them as read-only. The least
+    recently used entries are dropped once max_entries is reached, or once the results together
+    hold more than max_bytes (the most recent result is always kept).
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    # Returns (result, cached); fn(*args) only runs when (stage, key) has not been computed yet
+    def get_or_compute(self, stage, key, fn, *args):
+        cache_key = (stage, key)
+        with self._lock:
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+                return self._entries[cache_key], True
+
+        result = fn(*args)
+        size = object_bytes(result)
+        with self._lock:
+            self.total_bytes += size - self._sizes.get(cache_key, 0)
+            self._entries[cache_key] = result
+            self._sizes[cache_key] = size
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self.total_bytes > self.max_bytes and len(self._entries) > 1):
+                evicted, _ = self._entries.popitem(last=False)
+                self.total_bytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+        return result, False
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Bytes held per stage, largest first
+    def bytes_by_stage(self):
+        with self._lock:
+            totals = {}
+            for (stage, _), size in self._sizes.items():
+                totals[stage] = totals.get(stage, 0) + size
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+# Content hashes that make keys unique but unreadable in a timing table
+_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+# Short human-readable form of a stage key: its names and values without hashes or empty parts
+def describe_key(key):
+    if isinstance(key, tuple):
+        parts = [describe_key(part) for part in key]
+        return ', '.join(part for part in parts if part)
+    if key is None or (isinstance(key, str) and _HASH_PATTERN.match(key)):
+        return ''
+    return str(key)
+
+
+class StageRun:
+    """Runs the stages of one script rerun through a StageCache and records how long each took.
+
+    Frames are handed out as copy-on-write views, so a session can modify its result without
+    changing the cached one every other session sees. Each stage is also a span of the current
+    trace, so the model loads and inference it triggers nest under it.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.timings = []
+
+    def __call__(self, stage, key, fn, *args):
+        start = time.perf_counter()
+        with span(f'stage {stage}', key=describe_key(key)) as record:
+            result, cached = self.cache.get_or_compute(stage, key, fn, *args)
+            record['attributes']['cached'] = cached
+        self.timings.append({
+            'stage': stage,
+            'key': describe_key(key),
+            'ms': (time.perf_counter() - start) * 1000,
+            'cached': cached,
+        })
+        return session_view(result)
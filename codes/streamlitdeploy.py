@@ -1,7 +1,34 @@
+import io
+import json
+import os
+import time
+
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from pycaret.time_series import load_model, predict_model
+import plotly.graph_objects as go
+from cold_start import heavy_modules_loaded, record_timing, startup_timings, timed
+from exports import EXPORT_FORMATS, available_formats
+from forecast_service import (SCOPES, combine_data, company_total_forecast, forecast_cube, forecast_cube_key, get_export_cache,
+                              get_forecast_store, get_history_store, get_model_registry, get_retrain_worker, get_scenario_engine,
+                              get_trace_recorder, hierarchy_forecast, read_emissions_csv, shared_memory_bytes, warm_up_if_needed)
+from hierarchy import PORTFOLIO_LABEL, company_total_label
+from memory_budget import cache_budget_bytes, format_bytes, object_bytes
+from milestones import MILESTONE_YEARS, format_milestone, milestone_values
+from scenarios import RISK_LEVEL
+from stage_cache import StageCache, StageRun
+from tracing import Trace, span
+from upload_forecast import forecast_long_upload, forecast_upload, upload_hash
+from upload_ingest import ingest_long_upload, is_long_format
+
+script_start = time.perf_counter()
+
+# Every session shares the frames the forecast service hands out, so pandas copy-on-write keeps a
+# session's changes to what it is given (reindexing, setting values) from reaching the shared originals
+pd.set_option('mode.copy_on_write', True)
+
+# Everything this rerun does (stages, model loads, inference, chart rendering) is a span of one trace
+trace = Trace('streamlit rerun').start()
 
 # Sidebar information
 st.sidebar.header('About this Model')
@@ -14,98 +41,195 @@ Select a company to view forecasts and historical data.
 # Initialise file name
 file_name = ""
 
-# Define model paths
-model_paths = {
-    "Meta Scope 1": 'model/meta_scope1_model',
-    "Meta Scope 2": 'model/meta_scope2_model',
-    "Meta Scope 3": 'model/meta_scope3_model',
-    "Fujitsu Scope 1": 'model/fujitsu_scope1_model',
-    "Fujitsu Scope 2": 'model/fujitsu_scope2_model',
-    "Fujitsu Scope 3": 'model/fujitsu_scope3_model',
-    "Amazon Scope 1": 'model/amazon_scope1_model',
-    "Amazon Scope 2": 'model/amazon_scope2_model',
-    "Amazon Scope 3": 'model/amazon_scope3_model',
-    "Google Scope 1": 'model/google_scope1_model',
-    "Google Scope 2": 'model/google_scope2_model',
-    "Google Scope 3": 'model/google_scope3_model',
-    "Microsoft Scope 1": 'model/microsoft_scope1_model',
-    "Microsoft Scope 2": 'model/microsoft_scope2_model',
-    "Microsoft Scope 3": 'model/microsoft_scope3_model'
-}
-
-# Define historical data paths
-historical_data_paths = {
-    "Meta Scope 1": 'data/meta_scope1.csv',
-    "Meta Scope 2": 'data/meta_scope2.csv',
-    "Meta Scope 3": 'data/meta_scope3.csv',
-    "Fujitsu Scope 1": 'data/fujitsu_scope1.csv',
-    "Fujitsu Scope 2": 'data/fujitsu_scope2.csv',
-    "Fujitsu Scope 3": 'data/fujitsu_scope3.csv',
-    "Amazon Scope 1": 'data/amazon_scope1.csv',
-    "Amazon Scope 2": 'data/amazon_scope2.csv',
-    "Amazon Scope 3": 'data/amazon_scope3.csv',
-    "Google Scope 1": 'data/google_scope1.csv',
-    "Google Scope 2": 'data/google_scope2.csv',
-    "Google Scope 3": 'data/google_scope3.csv',
-    "Microsoft Scope 1": 'data/microsoft_scope1.csv',
-    "Microsoft Scope 2": 'data/microsoft_scope2.csv',
-    "Microsoft Scope 3": 'data/microsoft_scope3.csv'
-}
-
-# Load models
-def load_models(model_paths):
-    models = {}
-    for model_name, model_path in model_paths.items():
-        try:
-            models[model_name] = load_model(model_path)
-        except Exception as e:
-            st.error(f"Error loading model '{model_name}': {e}")
-    return models
-
-# Load historical data
-def load_historical_data(data_paths):
-    data = {}
-    for model_name, path in data_paths.items():
-        try:
-            data[model_name] = pd.read_csv(path, index_col='Year', parse_dates=True)
-        except Exception as e:
-            st.error(f"Error loading historical data for '{model_name}': {e}")
-    return data
-
-# Load models and historical data
-models = load_models(model_paths)
-historical_data = load_historical_data(historical_data_paths)
-
-# Function to combine historical and prediction data
-def combine_data(historical, prediction, label):
-    # Ensure the prediction length matches the forecast horizon
-    pred_index = pd.date_range(start=historical.index[-1] + pd.DateOffset(1), periods=len(prediction), freq='Y')
-    prediction_series = pd.Series(prediction, index=pred_index, name=f'Prediction {label}')
-    
-    # Combine the historical data with predictions
-    combined = pd.concat([historical, prediction_series], axis=0)
-    combined.columns = [f'{label} Original', f'{label} Prediction']
+# Load models and historical data. These are process-wide: every session (and the HTTP API, if enabled)
+# shares one model registry, one forecast store (model/forecasts.parquet) and one memory-mapped history table.
+# None of them imports PyCaret: models are only unpickled when a stored forecast is stale.
+with timed('open model registry, forecast store and history'):
+    models = get_model_registry()
+    forecasts = get_forecast_store()
+    historical_data = get_history_store()
+scenarios = get_scenario_engine()
+
+# Optionally serve the same forecasts over HTTP from this process, e.g. CARBONCAST_API_PORT=8502
+if os.environ.get('CARBONCAST_API_PORT'):
+    from forecast_api import start_api_server
+    start_api_server(int(os.environ['CARBONCAST_API_PORT']))
+
+# Optionally refit models in the background when the CSVs in data/ change, e.g. CARBONCAST_RETRAIN_INTERVAL=60.
+# Refitted models are swapped into this process's caches without a restart.
+retrain_worker = get_retrain_worker() if os.environ.get('CARBONCAST_RETRAIN_INTERVAL') else None
+if retrain_worker is not None:
+    retrain_worker.start(float(os.environ['CARBONCAST_RETRAIN_INTERVAL']))
+
+# Stage results (forecast -> combine -> milestone -> chart) shared by every session. Each stage is
+# keyed on the inputs it depends on, so a widget change only recomputes the stages downstream of it.
+# Sessions get copy-on-write views of cached frames; the cache is capped at CARBONCAST_CACHE_MB, past
+# which the least recently used results (in practice, parsed uploads and frames joined with them) go.
+@st.cache_resource
+def get_stage_cache():
+    return StageCache(max_bytes=cache_budget_bytes())
+
+run_stage = StageRun(get_stage_cache())
+
+# Send a figure to the browser; serialising large figures is a cost of its own, so it is traced apart
+def show_chart(fig):
+    with span('render chart'):
+        st.plotly_chart(fig)
+
+# Identity of a set of forecasts: model names plus the hash of the model file each came from
+def forecast_key(model_names):
+    return tuple((model_name, forecasts.model_hash(model_name)) for model_name in model_names if model_name in models)
+
+# Identity of frames that join forecasts with history: the forecasts' identity plus the fingerprint of
+# the history CSVs, since new data can be served before (or without) a refit of the model
+def history_key(model_names):
+    return (forecast_key(model_names), historical_data.fingerprint())
+
+# Forecast for a single model, reporting failures the same way the eager loader used to
+def get_forecast(model_name):
+    try:
+        return run_stage('forecast', forecast_key([model_name]), forecasts.get, model_name)
+    except Exception as e:
+        st.error(f"Error loading model '{model_name}': {e}")
+        return None
+
+# Historical data and predictions ({model_name: forecast, or None if it failed}) side by side
+def combine_models(model_names, predictions):
+    combined_data_list = []
+    for model_name in model_names:
+        if predictions.get(model_name) is not None:
+            combined_data_list.append(combine_data(historical_data[model_name], predictions[model_name]['y_pred'].values, model_name))
+    return pd.concat(combined_data_list, axis=1) if combined_data_list else pd.DataFrame()
+
+def combined_stage(model_names):
+    predictions = {model_name: get_forecast(model_name) for model_name in model_names if model_name in models}
+    if any(forecast is None for forecast in predictions.values()):
+        # Failed forecasts are retried on the next rerun, so a frame without them is not cached
+        return combine_models(model_names, predictions)
+    return run_stage('combine', history_key(model_names), combine_models, model_names, predictions)
+
+# Read an uploaded CSV and name its columns after the uploaded company
+def read_upload(upload_bytes, file_name):
+    return read_emissions_csv(io.BytesIO(upload_bytes), file_name)
+
+# Fit forecasts to an upload within its time budget. A timeout or failure is returned with an empty
+# result instead of raised, so it is cached like a result: later reruns report it without refitting.
+def fit_upload(forecast_fn, upload):
+    try:
+        return forecast_fn(upload), None
+    except Exception as e:
+        return {}, str(e)
+
+# Add the uploaded data and its forecasts to the chart data
+def join_upload(combined, user_data, user_forecasts, file_name):
+    combined = pd.concat([combined, user_data], axis=1)
+    for user_column in user_data.columns:
+        if user_column in user_forecasts:
+            # Each series is forecast from its own last observed year, which can differ between entities
+            predictions_combined_data = combine_data(user_data[[user_column]].dropna(), user_forecasts[user_column], user_column.removesuffix(' Original'))
+            combined = combined.join(predictions_combined_data.iloc[:,1:2])
     return combined
 
+# Line chart of every column against the year index
+def line_chart(data, title, columns=None):
+    return px.line(data,
+                   x=data.index,
+                   y=list(data.columns) if columns is None else columns,
+                   title=title,
+                   labels={"index": "Year", "value": "Emissions (in metric tons)"})
+
+def chart_stage(frame_key, data, title, columns=None):
+    return run_stage('chart', (frame_key, title, None if columns is None else tuple(columns)), line_chart, data, title, columns)
+
+def milestone_stage(frame_key, data, columns=None):
+    return run_stage('milestone', (frame_key, None if columns is None else tuple(columns)), milestone_values, data, MILESTONE_YEARS, columns)
+
+# Semi-transparent version of a '#rrggbb' plotly colour, for the uncertainty bands
+def band_colour(colour, alpha):
+    red, green, blue = (int(colour[i:i + 2], 16) for i in (1, 3, 5))
+    return f'rgba({red}, {green}, {blue}, {alpha})'
+
+# History plus 5-95% and 25-75% bands and the median of the simulated trajectories of each model
+def fan_chart(model_names, title):
+    fig = go.Figure()
+    colours = px.colors.qualitative.Plotly
+    for i, (model_name, fan) in enumerate(scenarios.fan(model_names).items()):
+        colour = colours[i % len(colours)]
+        history = historical_data[model_name].iloc[:, 0]
+        fig.add_trace(go.Scatter(x=history.index, y=history.values, name=f'{model_name} Original', line={'color': colour}))
+        for low, high, alpha in ((0.05, 0.95, 0.15), (0.25, 0.75, 0.3)):
+            fig.add_trace(go.Scatter(x=fan.index, y=fan[high], line={'width': 0}, showlegend=False, hoverinfo='skip'))
+            fig.add_trace(go.Scatter(x=fan.index, y=fan[low], line={'width': 0}, fill='tonexty', fillcolor=band_colour(colour, alpha),
+                                     name=f'{model_name} {low:.0%}-{high:.0%}'))
+        fig.add_trace(go.Scatter(x=fan.index, y=fan[0.5], name=f'{model_name} Median', line={'color': colour, 'dash': 'dash'}))
+    fig.update_layout(title=title, xaxis_title='Year', yaxis_title='Emissions (in metric tons)')
+    return fig
+
+def fan_stage(model_names, title):
+    model_names = [model_name for model_name in model_names if model_name in models]
+    return run_stage('fan chart', (history_key(model_names), title), fan_chart, model_names, title)
+
+def risk_stage(model_names):
+    model_names = [model_name for model_name in model_names if model_name in models]
+    return run_stage('emissions at risk', history_key(model_names), scenarios.emissions_at_risk, model_names)
+
+# Grouped bars of the emissions at risk of each scope and their total in each milestone year
+def risk_chart(risk, title):
+    bars = risk.reset_index().astype({'year': str})
+    return px.bar(bars, x='series', y='emissions_at_risk', color='year', barmode='group', title=title,
+                  labels={'series': '', 'emissions_at_risk': f'{RISK_LEVEL:.0%} quantile above median (metric tons)', 'year': 'Year'})
+
+# Table with a plain 'YYYY' index, built on a copy so the shared chart data keeps its dates
+def emissions_table(data):
+    carbon_emissions_table = data.copy(deep=False)
+
+    # Convert the index to datetime if it's not already in datetime format
+    carbon_emissions_table.index = pd.to_datetime(carbon_emissions_table.index)
+
+    # Extract the first 4 characters (year) from the index and assign it back
+    carbon_emissions_table.index = carbon_emissions_table.index.strftime('%Y')
+
+    # Rename the index to 'Year'
+    carbon_emissions_table.index.name = 'Year'
+    return carbon_emissions_table
+
 # Streamlit App
 st.title('''Carbon Cast 💨
 A Time Series Carbon Emission Forecast by Justin''')
 # User input for company and year
-company = st.sidebar.selectbox('Select a company:', ["Meta", "Fujitsu", "Amazon", "Google", "Microsoft"], index=0)
+companies = models.companies()
+company = st.sidebar.selectbox('Select a company:', companies, index=companies.index("Meta") if "Meta" in companies else 0)
 
 
 # File uploader for user CSV input
 uploaded_file = st.sidebar.file_uploader("Upload your CSV file here for comparison and prediction", type=["csv"])
 
-# Load user-uploaded data if provided
+# Load user-uploaded data if provided; every upload stage is keyed on the content hash of the file
 user_data = None
+upload_key = None
+long_upload = None
+upload_bytes = b''
 if uploaded_file is not None:
     try:
-        user_data = pd.read_csv(uploaded_file, index_col='Year', parse_dates=True)
         file_name = uploaded_file.name.split('_')[0]
-        st.sidebar.success("File uploaded successfully!")
+        upload_bytes = uploaded_file.getvalue()
+        content_key = upload_key = (upload_hash(upload_bytes), file_name)
+        if is_long_format(upload_bytes):
+            # One row per entity, scope and year (e.g. hundreds of subsidiaries): streamed and validated in
+            # chunks into compact arrays, then only the entities picked here are charted
+            long_upload = run_stage('upload', content_key, ingest_long_upload, upload_bytes)
+            upload_entities = st.sidebar.multiselect('Uploaded entities to chart:', long_upload.entities,
+                                                     default=long_upload.entities[:3], key='upload_entities')
+            upload_key = content_key + (tuple(upload_entities),)
+            if upload_entities:
+                user_data = run_stage('upload', upload_key, long_upload.frame, upload_entities)
+            st.sidebar.success(f"File uploaded successfully! {len(long_upload.entities)} entities, {len(long_upload):,} rows")
+        else:
+            user_data = run_stage('upload', upload_key, read_upload, upload_bytes, file_name)
+            st.sidebar.success("File uploaded successfully!")
     except Exception as e:
-        st.sidebar.error(f"Error loading file: {e}")
+        st.sidebar.error(f"Error loading file: {e}".replace('\n', '  \n'))
+        upload_key = None
 
 # Tabs for Combined Charts, Individual Scope Charts, and Data Table
 tab1, tab2, tab3 = st.tabs(["Combined Charts", "Individual Scope Charts", "Emission Data Table"])
@@ -113,233 +237,128 @@ tab1, tab2, tab3 = st.tabs(["Combined Charts", "Individual Scope Charts", "Emiss
 # Get the relevant model names for the selected company
 model_names = [f"{company} Scope 1", f"{company} Scope 2", f"{company} Scope 3"]
 
-combined_data_list = []
-
-for scope in model_names:
-    if scope in models:
-        predictions = predict_model(models[scope], fh=30)
-        combined_data = combine_data(historical_data[scope], predictions.values.flatten(), scope)
-        combined_data_list.append(combined_data)
-
 # Combine all scopes into a single DataFrame for plotting
-final_combined_data = pd.concat(combined_data_list, axis=1)
+final_combined_data = combined_stage(model_names)
+base_key = (history_key(model_names), upload_key)
 
 
 # Add user data to the charts if available
 if user_data is not None:
-    # Rename columns to align with the chart data
-    user_data.columns = [f'{file_name} Scope 1 Original', f'{file_name} Scope 2 Original', f'{file_name} Scope 3 Original']
-    final_combined_data = pd.concat([final_combined_data, user_data], axis=1)
+    # Forecast each uploaded scope from its own history rather than reusing another company's model
+    with st.spinner("Fitting forecasts to the uploaded data..."):
+        if long_upload is not None:
+            user_forecasts, upload_error = run_stage('upload forecast', content_key, fit_upload, forecast_long_upload, long_upload)
+        else:
+            user_forecasts, upload_error = run_stage('upload forecast', upload_key, fit_upload, forecast_upload, user_data)
+    if upload_error is not None:
+        st.sidebar.error(f"Error forecasting uploaded data: {upload_error}")
+    elif long_upload is None:
+        not_forecast = [column.removesuffix(' Original') for column in user_data.columns if column not in user_forecasts]
+        if not_forecast:
+            st.sidebar.warning(f"Not forecast (no values, or the fit failed): {', '.join(not_forecast)}")
 
-    # Scope 1 - Initialise a list to store predictions of user uploaded scopes
-    predictions_combined_data_list = []
+    # Combine user uploaded data with the preloaded data of the 5 companies
+    base_key = base_key + (tuple(column for column in user_data.columns if column in user_forecasts),)
+    final_combined_data = run_stage('combine', base_key, join_upload, final_combined_data, user_data, user_forecasts, file_name)
 
-    predictions_user_upload = predict_model(models["Meta Scope 1"], fh=30)
-    predictions_combined_data = combine_data(historical_data["Meta Scope 1"], predictions_user_upload.values.flatten(), file_name + " Scope 1")
-    predictions_combined_data_list.append(predictions_combined_data)
+    # 2030 and 2050 forecasts for user uploaded data, looked up by year rather than by row position.
+    # A wide upload has one label (the file name), a long-format upload one per charted entity.
+    user_labels = list(dict.fromkeys(column.rsplit(' Scope ', 1)[0] for column in user_data.columns))
+    user_prediction_columns = [f"{label} Scope {scope_number} Prediction" for label in user_labels for scope_number in SCOPES]
+    user_milestones = milestone_stage(base_key, final_combined_data, user_prediction_columns)
+
+    for label in user_labels:
+        for year in MILESTONE_YEARS:
+            st.subheader(f"{label} {year} Forecast in metric tonnes")
+            for scope_number in SCOPES:
+                st.write(f"Scope {scope_number}: {format_milestone(user_milestones.at[year, f'{label} Scope {scope_number} Prediction'])}")
 
-    # Combine all scopes into a single DataFrame for plotting
-    predictions_final_combined_data = pd.concat(predictions_combined_data_list, axis=1)
-    
-    # Combine user uploaded data with the preloaded data of the 5 companies
-    final_combined_data = final_combined_data.join(predictions_final_combined_data.iloc[:,1:2])
-    
-    
-    # Scope 2 - Initialise a list to store predictions of user uploaded scopes
-    predictions_combined_data_list = []
-
-    predictions_user_upload = predict_model(models["Meta Scope 2"], fh=30)
-    predictions_combined_data = combine_data(historical_data["Meta Scope 2"], predictions_user_upload.values.flatten(), file_name + " Scope 2")
-    predictions_combined_data_list.append(predictions_combined_data)
-
-    # Combine all scopes into a single DataFrame for plotting
-    predictions_final_combined_data = pd.concat(predictions_combined_data_list, axis=1)
-    
-    # Combine user uploaded data with the preloaded data of the 5 companies
-    final_combined_data = final_combined_data.join(predictions_final_combined_data.iloc[:,1:2])    
-    
-    
-    # Scope 3 - Initialise a list to store predictions of user uploaded scopes
-    predictions_combined_data_list = []
-
-    predictions_user_upload = predict_model(models["Meta Scope 3"], fh=30)
-    predictions_combined_data = combine_data(historical_data["Meta Scope 3"], predictions_user_upload.values.flatten(), file_name + " Scope 3")
-    predictions_combined_data_list.append(predictions_combined_data)
-
-    # Combine all scopes into a single DataFrame for plotting
-    predictions_final_combined_data = pd.concat(predictions_combined_data_list, axis=1)
-    
-    # Combine user uploaded data with the preloaded data of the 5 companies
-    final_combined_data = final_combined_data.join(predictions_final_combined_data.iloc[:,1:2])
-    
-    # Set pandas option to display floats without scientific notation
-    pd.set_option('display.float_format', '{:,.3f}'.format)
-
-    # 2030 forecast - for user uploaded data
-    forecast_2030_scope1 = str(final_combined_data.iloc[15:16,9:10]).split(" ")[-1]
-    forecast_2030_scope2 = str(final_combined_data.iloc[15:16,10:11]).split(" ")[-1]
-    forecast_2030_scope3 = str(final_combined_data.iloc[15:16,11:12]).split(" ")[-1]
-
-    st.subheader(f"{file_name} 2030 Forecast in metric tonnes")
-    st.write(f"Scope 1: {forecast_2030_scope1}")
-    st.write(f"Scope 2: {forecast_2030_scope2}")
-    st.write(f"Scope 3: {forecast_2030_scope3}")
-
-    # 2050 forecast - for user uploaded data
-    forecast_2050_scope1 = str(final_combined_data.iloc[35:36,9:10]).split(" ")[-1]
-    forecast_2050_scope2 = str(final_combined_data.iloc[35:36,10:11]).split(" ")[-1]
-    forecast_2050_scope3 = str(final_combined_data.iloc[35:36,11:12]).split(" ")[-1]
-
-    st.subheader(f"{file_name} 2050 Forecast in metric tonnes")
-    st.write(f"Scope 1: {forecast_2050_scope1}")
-    st.write(f"Scope 2: {forecast_2050_scope2}")
-    st.write(f"Scope 3: {forecast_2050_scope3}")
-
-        #st.dataframe(final_combined_data.iloc[35:36,9:])  
-    
-    
-     
 
 # Combined Charts Tab
 with tab1:
     st.subheader(f'{company} Carbon Emissions: Scopes 1, 2, and 3 (Original vs Predictions)')
                   # Create two columns: one for the chart, one for the forecast values
     # Multi-select widget to choose companies for comparison
-    companies_to_compare = st.multiselect('Compare with:', ["Meta", "Fujitsu", "Amazon", "Google", "Microsoft"], key='company_comparison')
+    companies_to_compare = st.multiselect('Compare with:', companies, key='company_comparison')
+    chart_data, chart_key = final_combined_data, base_key
     if companies_to_compare:
-        combined_data_list = []
-
-        for company in companies_to_compare:
-            model_names = [f"{company} Scope 1", f"{company} Scope 2", f"{company} Scope 3"]
-            for scope in model_names:
-                if scope in models:
-                    predictions = predict_model(models[scope], fh=30)
-                    combined_data = combine_data(historical_data[scope], predictions.values.flatten(), scope)
-                    combined_data_list.append(combined_data)
-
-        if combined_data_list:
-            final_combined_data = pd.concat(combined_data_list, axis=1)
+        comparison_names = [f"{comp} Scope {scope_number}" for comp in companies_to_compare for scope_number in SCOPES]
+        comparison_data = combined_stage(comparison_names)
+        if not comparison_data.empty:
+            chart_data, chart_key = comparison_data, history_key(comparison_names)
 
         # Render a line chart with the combined data
-        fig_combined = px.line(final_combined_data, 
-                               x=final_combined_data.index, 
-                               y=final_combined_data.columns, 
-                               title=f'{company}: Comparing Scopes 1, 2, and 3 with Selected Companies', 
-                               labels={"index": "Year", "value": "Emissions (in metric tons)"})
+        fig_combined = chart_stage(chart_key, chart_data, f'{companies_to_compare[-1]}: Comparing Scopes 1, 2, and 3 with Selected Companies')
 
-    else: 
-        fig_combined = px.line(final_combined_data, 
-                               x=final_combined_data.index, 
-                               y=final_combined_data.columns, 
-                               title=f'Compare against {file_name} Original', 
-                               labels={"index": "Year", "value": "Emissions (in metric tons)"})
+    else:
+        fig_combined = chart_stage(chart_key, chart_data, f'Compare against {file_name} Original')
 
 
 
     #Display the chart with annotations
-    st.plotly_chart(fig_combined)
-
-    # Set pandas option to display floats without scientific notation
-    pd.set_option('display.float_format', '{:,.3f}'.format)
+    show_chart(fig_combined)
 
-
-    # Ensure index is a DatetimeIndex
-    if isinstance(final_combined_data.index, pd.PeriodIndex):
-        final_combined_data.index = final_combined_data.index.to_timestamp()
-    
-    # Retrieve the year from the index
-    if isinstance(final_combined_data.index, pd.DatetimeIndex):
-        years = final_combined_data.index.year
-
-    # Extract forecasts for 2030 and 2050 dynamically
-    try:
-        # Construct column names dynamically
-        col_scope1 = f"{company} Scope 1 Prediction"
-        col_scope2 = f"{company} Scope 2 Prediction"
-        col_scope3 = f"{company} Scope 3 Prediction"
-
-     
-        # Extract forecasts for 2030
-        companies_forecast_2030_scope1 = str(final_combined_data.loc[years == 2030, col_scope1].values[0]).split(" ")[-1]
-        companies_forecast_2030_scope2 = str(final_combined_data.loc[years == 2030, col_scope2].values[0]).split(" ")[-1]
-        companies_forecast_2030_scope3 = str(final_combined_data.loc[years == 2030, col_scope3].values[0]).split(" ")[-1]
-
-        # Extract forecasts for 2050
-        companies_forecast_2050_scope1 = str(final_combined_data.loc[years == 2050, col_scope1].values[0]).split(" ")[-1]
-        companies_forecast_2050_scope2 = str(final_combined_data.loc[years == 2050, col_scope2].values[0]).split(" ")[-1]
-        companies_forecast_2050_scope3 = str(final_combined_data.loc[years == 2050, col_scope3].values[0]).split(" ")[-1]
-    except KeyError as e:
-        st.error(f"KeyError: {e}")
-        companies_forecast_2030_scope1 = companies_forecast_2030_scope2 = companies_forecast_2030_scope3 = 'Data not available'
-        companies_forecast_2050_scope1 = companies_forecast_2050_scope2 = companies_forecast_2050_scope3 = 'Data not available'
+    # 2030 and 2050 forecasts of the selected company, in one lookup
+    company_columns = [f"{company} Scope {scope_number} Prediction" for scope_number in SCOPES]
+    company_milestones = milestone_stage(base_key, final_combined_data, company_columns)
 
     st.subheader(f"{company} 2030 and 2050 Forecast in metric tonnes")
-    st.write(f"2030 Scope 1: {companies_forecast_2030_scope1}")
-    st.write(f"2030 Scope 2: {companies_forecast_2030_scope2}")
-    st.write(f"2030 Scope 3: {companies_forecast_2030_scope3}")
-    st.write(f"2050 Scope 1: {companies_forecast_2050_scope1}")
-    st.write(f"2050 Scope 2: {companies_forecast_2050_scope2}")
-    st.write(f"2050 Scope 3: {companies_forecast_2050_scope3}")
+    for year in MILESTONE_YEARS:
+        for scope_number, column in zip(SCOPES, company_columns):
+            st.write(f"{year} Scope {scope_number}: {format_milestone(company_milestones.at[year, column])}")
+
+    # Scope 1+2+3 total, reconciled with the scope forecasts across every company in one matrix product
+    reconcile_key = history_key(list(models.model_paths))
+    reconciled = run_stage('reconcile', reconcile_key, hierarchy_forecast)
+    if company_total_label(company) in reconciled.index:
+        # The portfolio aggregate couples every company, so the total follows any model, not just this company's
+        total_key = ('total', company, reconcile_key)
+        total_label = company_total_label(company)
+        total_data = run_stage('combine', total_key, company_total_forecast, company, reconciled)
+        st.subheader(f"{company} Total Emissions (Scopes 1 + 2 + 3)")
+        show_chart(chart_stage(total_key, total_data, f'{total_label} (Original vs Reconciled Prediction)'))
+        total_milestones = milestone_stage(total_key, total_data)
+        for year in MILESTONE_YEARS:
+            st.write(f"{year} Total: {format_milestone(total_milestones.at[year, f'{total_label} Prediction'])}")
+        with st.expander("Reconciled scope forecasts"):
+            reconciled_rows = [total_label] + [model_name for model_name in model_names if model_name in reconciled.index] + [PORTFOLIO_LABEL]
+            reconciled_milestones = reconciled.loc[reconciled_rows, reconciled.columns.year.isin(MILESTONE_YEARS)]
+            st.dataframe(reconciled_milestones.set_axis(reconciled_milestones.columns.year, axis=1).style.format('{:,.0f}'))
+            st.caption("The total and scope forecasts are reconciled so the scopes add up to the total. Scope values can "
+                       "therefore differ slightly from the individual model forecasts above.")
+
+    # Uncertainty: simulated trajectories of each scope, and how far the bad tail lies above the median
+    st.subheader(f"{company} Forecast Uncertainty ({scenarios.draws:,} simulated trajectories per scope)")
+    show_chart(fan_stage(model_names, f'{company}: Scopes 1, 2 and 3 with 50% and 90% bands'))
+    company_risk = risk_stage(model_names)
+    show_chart(run_stage('chart', ('emissions at risk', history_key(model_names)), risk_chart, company_risk,
+                         f'{company} Emissions at Risk ({RISK_LEVEL:.0%}) in {" and ".join(map(str, MILESTONE_YEARS))}'))
+    st.dataframe(company_risk.style.format('{:,.0f}'))
 
 
 # Comparison case: When users select companies to compare
     if companies_to_compare:
-        # Initialize dictionary to store forecasts for each company
-        forecast_values = {}
-    
-        for company in companies_to_compare:
-            # Dynamically construct column names for Scope 1, Scope 2, and Scope 3 predictions
-            col_scope1 = f"{company} Scope 1 Prediction"
-            col_scope2 = f"{company} Scope 2 Prediction"
-            col_scope3 = f"{company} Scope 3 Prediction"
-    
-            # Initialize default values for the company
-            forecast_values[company] = {'2030': ['Data not available'] * 3, '2050': ['Data not available'] * 3}
-    
-            # Check if the columns exist in the DataFrame
-            if col_scope1 in final_combined_data.columns and col_scope2 in final_combined_data.columns and col_scope3 in final_combined_data.columns:
-                try:
-                    # Convert columns to numeric (in case there are non-numeric values)
-                    final_combined_data[col_scope1] = pd.to_numeric(final_combined_data[col_scope1], errors='coerce')
-                    final_combined_data[col_scope2] = pd.to_numeric(final_combined_data[col_scope2], errors='coerce')
-                    final_combined_data[col_scope3] = pd.to_numeric(final_combined_data[col_scope3], errors='coerce')
-    
-                    # Extract forecasts for 2030
-                    forecast_2030_scope1 = final_combined_data.loc[years == 2030, col_scope1].values[0]
-                    forecast_2030_scope2 = final_combined_data.loc[years == 2030, col_scope2].values[0]
-                    forecast_2030_scope3 = final_combined_data.loc[years == 2030, col_scope3].values[0]
-    
-                    # Extract forecasts for 2050
-                    forecast_2050_scope1 = final_combined_data.loc[years == 2050, col_scope1].values[0]
-                    forecast_2050_scope2 = final_combined_data.loc[years == 2050, col_scope2].values[0]
-                    forecast_2050_scope3 = final_combined_data.loc[years == 2050, col_scope3].values[0]
-    
-                    # Store the forecasts in the dictionary
-                    forecast_values[company] = {
-                        '2030': [forecast_2030_scope1, forecast_2030_scope2, forecast_2030_scope3],
-                        '2050': [forecast_2050_scope1, forecast_2050_scope2, forecast_2050_scope3]
-                    }
-    
-                except (KeyError, IndexError) as e:
-                    st.error(f"Error retrieving forecast data for {company}: {e}")
-            else:
-                st.error(f"Data for {company} is not available in the dataset.")
-    
+        chart_milestones = milestone_stage(chart_key, chart_data)
+        for comp in companies_to_compare:
+            if not all(f"{comp} Scope {scope_number} Prediction" in chart_milestones.columns for scope_number in SCOPES):
+                st.error(f"Data for {comp} is not available in the dataset.")
 
         # If exactly two companies are selected, calculate and display percentage differences
         if len(companies_to_compare) == 2:
             company_1, company_2 = companies_to_compare
-    
+
             st.subheader(f"Percentage Difference between {company_1} and {company_2} (2030 and 2050)")
-    
+
             # Calculate percentage difference for each year and scope
-            for year in ['2030', '2050']:
-                for i, scope in enumerate(['Scope 1', 'Scope 2', 'Scope 3']):
-                    value_1 = forecast_values[company_1][year][i]
-                    value_2 = forecast_values[company_2][year][i]
-    
+            compare_milestones = chart_milestones.reindex(columns=[f"{comp} Scope {scope_number} Prediction" for comp in (company_1, company_2) for scope_number in SCOPES])
+            for year in MILESTONE_YEARS:
+                for scope_number in SCOPES:
+                    scope = f"Scope {scope_number}"
+                    value_1 = compare_milestones.at[year, f"{company_1} {scope} Prediction"]
+                    value_2 = compare_milestones.at[year, f"{company_2} {scope} Prediction"]
+
                     # Check if the data is available for both companies
-                    if 'Data not available' not in [value_1, value_2]:
+                    if pd.notna(value_1) and pd.notna(value_2):
                         # Calculate percentage difference if the first value is not zero
                         percentage_diff = ((value_2 - value_1) / value_1) * 100 if value_1 != 0 else float('inf')
                         st.write(f"{year} {scope}: {company_1}: {value_1:.3f}, {company_2}: {value_2:.3f}")
@@ -347,34 +366,21 @@ with tab1:
                     else:
                         st.write(f"{year} {scope}: Data not available for comparison.")
 
-    
+
 # Individual Scope Chart
 with tab2:
     # Multi-select widget to choose companies for comparison
-    companies_to_compare = st.multiselect('Compare with:', ["Meta", "Fujitsu", "Amazon", "Google", "Microsoft"], key='company_comparison_indv')
+    companies_to_compare = st.multiselect('Compare with:', companies, key='company_comparison_indv')
 
     if companies_to_compare:
         st.subheader('Comparison of Selected Companies')
 
         # Loop through each scope (Scope 1, Scope 2, Scope 3)
         for scope in ['Scope 1', 'Scope 2', 'Scope 3']:
-            # Initialize an empty DataFrame to hold the comparison data for the current scope
-            comparison_data = pd.DataFrame()
-
             # Collect data for each selected company for the current scope
-            for comp in companies_to_compare:
-                scope_name = f"{comp} {scope}"
-                if scope_name in models:
-                    try:
-                        # Make predictions for the current scope
-                        predictions = predict_model(models[scope_name], fh=30)
-                        combined_data = combine_data(historical_data[scope_name], predictions.values.flatten(), f'{comp} {scope}')
-                        # Store the predictions and original data for comparison
-                        comparison_data[f'{comp} {scope} Original'] = combined_data[f'{comp} {scope} Original']
-                        comparison_data[f'{comp} {scope} Prediction'] = combined_data[f'{comp} {scope} Prediction']
-
-                    except Exception as e:
-                        st.error(f"Error with {scope_name}: {e}")
+            scope_names = [f"{comp} {scope}" for comp in companies_to_compare]
+            comparison_data = combined_stage(scope_names)
+            comparison_key = history_key(scope_names)
 
             # Plot the comparison data for the current scope if any data exists
             if not comparison_data.empty:
@@ -385,30 +391,17 @@ with tab2:
 
                 # In the first column, display the chart
                 with col1:
-                    fig_scope_compare = px.line(comparison_data,
-                                                x=comparison_data.index,
-                                                y=comparison_data.columns,
-                                                title=f'{scope} Comparison: Original vs Predictions',
-                                                labels={"index": "Year", "value": "Emissions (in metric tons)"})
-                    st.plotly_chart(fig_scope_compare)
+                    fig_scope_compare = chart_stage(comparison_key, comparison_data, f'{scope} Comparison: Original vs Predictions')
+                    show_chart(fig_scope_compare)
 
                 # In the second column, display the forecast values for 2030 and 2050
                 with col2:
-                    try:
-                        
-                        # Retrieve the forecast values for the current scope
-                        forecast_2030 = predictions.loc['2030'].values.flatten() if '2030' in predictions.index else "2030 data not available"
-                        forecast_2050 = predictions.loc['2050'].values.flatten() if '2050' in predictions.index else "2050 data not available"
-                        st.write(f"### {scope} Forecast")
-                        st.write(f"- **2030 Forecast**: {forecast_2030}")
-                        st.write(f"- **2050 Forecast**: {forecast_2050}")
-
-                        #st.write(f"### {scope} Forecast")
-                        #st.write(f"- **2030 Forecastwewe**: {final_combined_data.iloc[0:10]}")
-                        #st.write(f"- **2050 Forecast**: {forecast_2050}")
-                    
-                    except Exception as e:
-                        st.write(f"Error fetching forecast data for {scope}: {e}")
+                    # Retrieve the forecast values of every compared company for the current scope
+                    scope_milestones = milestone_stage(comparison_key, comparison_data)
+                    st.write(f"### {scope} Forecast")
+                    for column in scope_milestones.columns:
+                        for year in MILESTONE_YEARS:
+                            st.write(f"- **{column.rsplit(' ' + scope, 1)[0]} {year} Forecast**: {format_milestone(scope_milestones.at[year, column])}")
 
             else:
                 st.warning(f"No data available for {scope} comparison.")
@@ -424,65 +417,33 @@ with tab2:
 
                 # In the first column, display the chart
                 with col1:
-                    fig_scope = px.line(final_combined_data[[f'{scope} Original', f'{scope} Prediction']],
-                                        x=final_combined_data.index,
-                                        y=[f'{scope} Original', f'{scope} Prediction'],
-                                        title=f'{company} {scope} (Original vs Prediction)',
-                                        labels={"index": "Year", "value": "Emissions (in metric tons)"})
-                    st.plotly_chart(fig_scope)
+                    fig_scope = chart_stage(base_key, final_combined_data, f'{company} {scope} (Original vs Prediction)', [f'{scope} Original', f'{scope} Prediction'])
+                    show_chart(fig_scope)
+                    if scope in models:
+                        show_chart(fan_stage([scope], f'{scope}: 50% and 90% bands'))
 
                 # In the second column, display the forecast values for 2030 and 2050
                 with col2:
-                    try:
-
-                         # Set pandas option to display floats without scientific notation
-                        pd.set_option('display.float_format', '{:,.3f}'.format)                       
-                        
-                        forecast_2030 = final_combined_data.loc['2030', f'{scope} Prediction'].values.flatten()[0] if '2030' in predictions.index else "2030 data not available"
-                        forecast_2050 = final_combined_data.loc['2050', f'{scope} Prediction'].values.flatten()[0] if '2050' in predictions.index else "2050 data not available"
-                        
-                        st.write(f"- **2030 Forecast**: {forecast_2030}")
-                        st.write(f"- **2050 Forecast**: {forecast_2050}")
-                        
-                    
-                    except Exception as e:
-                        st.write(f"Error fetching forecast data for {scope}: {e}")
-                    
+                    scope_milestones = milestone_stage(base_key, final_combined_data, [f'{scope} Prediction'])
+                    for year in MILESTONE_YEARS:
+                        st.write(f"- **{year} Forecast**: {format_milestone(scope_milestones.at[year, f'{scope} Prediction'])}")
+                    if scope in models:
+                        scope_risk = risk_stage([scope])
+                        for year in MILESTONE_YEARS:
+                            st.write(f"- **{year} at risk ({RISK_LEVEL:.0%})**: +{format_milestone(scope_risk.at[(scope, year), 'emissions_at_risk'])}")
+
     # Add User Data Chart if available
     if user_data is not None:
         st.subheader(f'{file_name} (Scope 1, Scope 2, Scope 3)')
-        fig_user = px.line(user_data, 
-                           x=user_data.index, 
-                           y=user_data.columns, 
-                           title=f'{file_name} (Scope 1, Scope 2, Scope 3)', 
-                           labels={"index": "Year", "value": "Emissions (in metric tons)"})
-        st.plotly_chart(fig_user)
-        
-        
-        # Set pandas option to display floats without scientific notation
-        pd.set_option('display.float_format', '{:,.3f}'.format)
-
-        # 2030 forecast - for user uploaded data
-        forecast_2030_scope1 = str(final_combined_data.iloc[15:16,9:10]).split(" ")[-1]
-        forecast_2030_scope2 = str(final_combined_data.iloc[15:16,10:11]).split(" ")[-1]
-        forecast_2030_scope3 = str(final_combined_data.iloc[15:16,11:12]).split(" ")[-1]
-
-        st.subheader(f"{file_name} 2030 Forecast")
-        st.write(f"Scope 1: {forecast_2030_scope1}")
-        st.write(f"Scope 2: {forecast_2030_scope2}")
-        st.write(f"Scope 3: {forecast_2030_scope3}")
-
-        # 2050 forecast - for user uploaded data
-        forecast_2050_scope1 = str(final_combined_data.iloc[35:36,9:10]).split(" ")[-1]
-        forecast_2050_scope2 = str(final_combined_data.iloc[35:36,10:11]).split(" ")[-1]
-        forecast_2050_scope3 = str(final_combined_data.iloc[35:36,11:12]).split(" ")[-1]
-
-        st.subheader(f"{file_name} 2050 Forecast")
-        st.write(f"Scope 1: {forecast_2050_scope1}")
-        st.write(f"Scope 2: {forecast_2050_scope2}")
-        st.write(f"Scope 3: {forecast_2050_scope3}")
-
-        #st.dataframe(final_combined_data.iloc[35:36,9:])
+        fig_user = chart_stage(upload_key, user_data, f'{file_name} (Scope 1, Scope 2, Scope 3)')
+        show_chart(fig_user)
+
+
+        for label in user_labels:
+            for year in MILESTONE_YEARS:
+                st.subheader(f"{label} {year} Forecast")
+                for scope_number in SCOPES:
+                    st.write(f"Scope {scope_number}: {format_milestone(user_milestones.at[year, f'{label} Scope {scope_number} Prediction'])}")
 
 
 # Data Table Tab
@@ -494,21 +455,91 @@ with tab3:
         subheader_text = 'Carbon Emissions Table'
     st.subheader(subheader_text)
 
-    carbon_emissions_table = final_combined_data
-    
-    # Convert the index to datetime if it's not already in datetime format
-    carbon_emissions_table.index = pd.to_datetime(carbon_emissions_table.index)
-        
-    # Extract the first 4 characters (year) from the index and assign it back
-    carbon_emissions_table.index = carbon_emissions_table.index.strftime('%Y')
-        
-    # Rename the index to 'Year'
-    carbon_emissions_table.index.name = 'Year'
-    
+    carbon_emissions_table = run_stage('table', chart_key, emissions_table, chart_data)
+
     # Display the updated table
     st.write(carbon_emissions_table)
 
 
-# Download as CSV
-csv = final_combined_data.to_csv().encode('utf-8')
-st.download_button(label="Download data as CSV", data=csv, file_name=f'{company}_emissions_comparison.csv', mime='text/csv')
+# Downloads are serialised only when clicked, then kept on disk by the fingerprint of their data and
+# shared by every session, so reruns never pay for them. The callables run after this rerun has moved
+# on, hence the values bound as defaults.
+exports = get_export_cache()
+st.download_button(label="Download data as CSV", file_name=f'{company}_emissions_comparison.csv', mime='text/csv',
+                   data=lambda key=('table', chart_key), table=carbon_emissions_table: exports.read(key, 'csv', lambda: [table.reset_index()]))
+
+# Every company's forecasts as one long table (company, scope, year), written a company at a time
+export_format = st.selectbox('Export all forecasts as:', available_formats(), format_func=lambda export_format: EXPORT_FORMATS[export_format]['label'])
+if 'xlsx' not in available_formats():
+    st.caption("Excel export is unavailable: install the requirements (openpyxl) to enable it.")
+st.download_button(label=f"Download all forecasts ({EXPORT_FORMATS[export_format]['label']})",
+                   file_name=f"carboncast_forecasts.{EXPORT_FORMATS[export_format]['extension']}", mime=EXPORT_FORMATS[export_format]['mime'],
+                   data=lambda export_format=export_format: exports.read(forecast_cube_key(), export_format, forecast_cube))
+
+
+# The first page is rendered from precomputed forecasts; only now, if some forecast will need live
+# inference, does the modelling stack start importing in the background
+record_timing('first render', time.perf_counter() - script_start)
+warm_up_if_needed()
+
+# Model load time and memory, for the models this process has loaded so far
+with st.sidebar.expander('Model load stats'):
+    fresh_count = sum(forecasts.is_fresh(model_name) for model_name in models.model_paths)
+    st.write(f"{fresh_count} of {len(models)} forecasts served from the precomputed store")
+    load_stats = models.load_stats()
+    if load_stats:
+        load_stats_table = pd.DataFrame.from_dict(load_stats, orient='index')
+        load_stats_table['memory_kb'] = load_stats_table.pop('memory_bytes') / 1024
+        load_stats_table['file_kb'] = load_stats_table.pop('file_bytes') / 1024
+        st.dataframe(load_stats_table)
+        st.write(f"{len(load_stats)} of {len(models)} models loaded")
+    else:
+        st.write("No models loaded yet")
+
+# Time spent in each stage during this rerun; cached stages show what a widget change did not redo
+with st.sidebar.expander('Stage timings'):
+    stage_timings = pd.DataFrame(run_stage.timings)
+    st.write(f"{(~stage_timings['cached']).sum()} of {len(stage_timings)} stages recomputed, {stage_timings['ms'].sum():.1f} ms in total")
+    st.dataframe(stage_timings)
+
+# Memory shared by every session versus held by this one. Cached stage results are shared too; what a
+# session adds is its uploaded file and widget state, since the frames it works on are views.
+with st.sidebar.expander('Memory'):
+    stage_cache = get_stage_cache()
+    shared_bytes = {**shared_memory_bytes(), 'stage cache': stage_cache.total_bytes}
+    session_bytes = {'uploaded file': len(upload_bytes), 'widget state': object_bytes(dict(st.session_state))}
+    st.write(f"Shared by all sessions: {format_bytes(sum(shared_bytes.values()))}")
+    st.dataframe(pd.Series({name: format_bytes(size) for name, size in shared_bytes.items()}, name='bytes'))
+    st.write(f"This session: {format_bytes(sum(session_bytes.values()))}")
+    st.dataframe(pd.Series({name: format_bytes(size) for name, size in session_bytes.items()}, name='bytes'))
+    st.write(f"Stage cache: {len(stage_cache)} results, {format_bytes(stage_cache.total_bytes)} of "
+             f"{format_bytes(stage_cache.max_bytes)}, {stage_cache.evictions} evicted")
+
+# Recent background refits, when the retraining worker is enabled
+if retrain_worker is not None:
+    with st.sidebar.expander('Retraining'):
+        if retrain_worker.results:
+            st.dataframe(pd.DataFrame(retrain_worker.results).drop(columns=['detail'], errors='ignore'))
+        else:
+            st.write(f"Watching {retrain_worker.data_dir}/; no models refitted yet")
+
+# Cold-start cost of this process: first-time phases and whether the modelling libraries are loaded yet
+with st.sidebar.expander('Start-up timings'):
+    st.dataframe(pd.Series(startup_timings(), name='seconds').rename_axis('phase'))
+    heavy_modules = heavy_modules_loaded()
+    st.write(f"Modelling libraries loaded: {', '.join(heavy_modules)}" if heavy_modules else "Modelling libraries not loaded yet")
+
+trace.finish()
+get_trace_recorder().record(trace)
+
+# Per-span timings of this rerun and trace exports, with CARBONCAST_DEBUG=1 or ?debug=1 in the URL
+if os.environ.get('CARBONCAST_DEBUG') == '1' or st.query_params.get('debug') == '1':
+    with st.sidebar.expander('Trace', expanded=True):
+        st.write(f"This rerun: {trace.duration_ms():.1f} ms, {len(trace.spans)} spans")
+        span_table = pd.DataFrame(trace.span_table()).sort_values('self_ms', ascending=False)
+        st.dataframe(span_table.head(20), hide_index=True)
+        recorder = get_trace_recorder()
+        st.download_button("OpenTelemetry traces (OTLP/JSON)", data=json.dumps(recorder.otlp_json()),
+                           file_name='carboncast_traces.json', mime='application/json')
+        st.download_button("Span histograms (Prometheus)", data=recorder.prometheus_text(),
+                           file_name='carboncast_metrics.prom', mime='text/plain')
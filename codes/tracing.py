@@ -0,0 +1,192 @@
+import contextvars
+import json
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+SERVICE_NAME = 'carbon-cast'
+
+# Traces kept in memory for the debug panel and the exports
+MAX_TRACES = 100
+
+# Upper bounds (seconds) of the Prometheus duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Trace:
+    """Spans recorded during one script rerun or API request, each a dict in the order it finished.
+
+    Spans opened with span() anywhere in the same thread (or in tasks and threads that copy its
+    context) while the trace is active nest under whichever span is open at the time.
+    """
+
+    def __init__(self, name, **attributes):
+        self.trace_id = secrets.token_hex(16)
+        self.name = name
+        self.spans = []
+        self.attributes = dict(attributes)
+        self._root = None
+        self._token = None
+
+    # Make this the current trace and open its root span, whose attributes are self.attributes
+    def start(self):
+        self._token = _current_trace.set(self)
+        # A rerun that Streamlit stopped midway never closed its spans, so the root has no parent
+        _current_span.set(None)
+        self._root = _open_span(self.name, {})
+        self._root['attributes'] = self.attributes
+        return self
+
+    # Close the root span and stop recording into this trace
+    def finish(self):
+        if self._token is not None:
+            _close_span(self._root, self)
+            _current_trace.reset(self._token)
+            self._token = None
+        return self
+
+    def duration_ms(self):
+        return self._root['duration_ns'] / 1e6 if self._root and 'duration_ns' in self._root else None
+
+    # Finished spans as a frame-friendly list with their own time (duration minus their children's)
+    def span_table(self):
+        child_ns = {}
+        for record in self.spans:
+            if record['parent_id'] is not None:
+                child_ns[record['parent_id']] = child_ns.get(record['parent_id'], 0) + record['duration_ns']
+        return [{'span': record['name'], **{key: str(value) for key, value in record['attributes'].items()},
+                 'ms': record['duration_ns'] / 1e6, 'self_ms': (record['duration_ns'] - child_ns.get(record['span_id'], 0)) / 1e6,
+                 'status': record['status']} for record in self.spans]
+
+
+def _open_span(name, attributes):
+    parent = _current_span.get()
+    record = {'name': name, 'span_id': secrets.token_hex(8), 'parent_id': parent['span_id'] if parent else None,
+              'start_ns': time.time_ns(), 'attributes': dict(attributes), 'status': 'ok', '_start': time.perf_counter_ns(),
+              '_token': None}
+    record['_token'] = _current_span.set(record)
+    return record
+
+
+def _close_span(record, trace):
+    record['duration_ns'] = time.perf_counter_ns() - record.pop('_start')
+    record['end_ns'] = record['start_ns'] + record['duration_ns']
+    _current_span.reset(record.pop('_token'))
+    trace.spans.append(record)
+
+
+# Time a block as a span of the current trace; a no-op outside a trace. Attributes can be added to the
+# yielded record's 'attributes' while the block runs.
+@contextmanager
+def span(name, **attributes):
+    trace = _current_trace.get()
+    if trace is None:
+        yield {'attributes': {}}
+        return
+    record = _open_span(name, attributes)
+    try:
+        yield record
+    except BaseException as e:
+        record['status'] = 'error'
+        record['attributes']['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _close_span(record, trace)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class TraceRecorder:
+    """Process-wide store of the latest traces plus cumulative span duration histograms.
+
+    Exports the traces as OTLP/JSON (the OpenTelemetry protocol's JSON encoding, readable by an
+    OpenTelemetry collector) and the histograms in the Prometheus text exposition format.
+    """
+
+    def __init__(self, max_traces=MAX_TRACES, buckets=DURATION_BUCKETS, export_path=None):
+        self.buckets = buckets
+        self.export_path = export_path
+        self._traces = deque(maxlen=max_traces)
+        self._histograms = {}
+        self._trace_counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        with self._lock:
+            self._traces.append(trace)
+            self._trace_counts[trace.name] = self._trace_counts.get(trace.name, 0) + 1
+            for record in trace.spans:
+                labels = (record['name'], str(record['attributes'].get('cached', '')).lower())
+                histogram = self._histograms.setdefault(labels, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+                seconds = record['duration_ns'] / 1e9
+                for i, bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        histogram['buckets'][i] += 1
+                histogram['sum'] += seconds
+                histogram['count'] += 1
+            if self.export_path:
+                with open(self.export_path, 'a') as f:
+                    f.write(json.dumps(self.otlp_json([trace])) + '\n')
+
+    def traces(self):
+        with self._lock:
+            return list(self._traces)
+
+    # OTLP/JSON export request body for the given traces (default: every trace kept)
+    def otlp_json(self, traces=None):
+        traces = self.traces() if traces is None else traces
+        spans = []
+        for trace in traces:
+            for record in trace.spans:
+                otlp_span = {
+                    'traceId': trace.trace_id,
+                    'spanId': record['span_id'],
+                    'name': record['name'],
+                    'kind': 1,
+                    'startTimeUnixNano': str(record['start_ns']),
+                    'endTimeUnixNano': str(record['end_ns']),
+                    'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in record['attributes'].items()],
+                    'status': {'code': 2, 'message': record['attributes'].get('error', '')} if record['status'] == 'error' else {'code': 1},
+                }
+                if record['parent_id'] is not None:
+                    otlp_span['parentSpanId'] = record['parent_id']
+                spans.append(otlp_span)
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': 'carboncast.tracing'}, 'spans': spans}],
+        }]}
+
+    # Prometheus text exposition of span durations since the process started
+    def prometheus_text(self):
+        lines = ['# HELP carboncast_span_duration_seconds Duration of traced spans.',
+                 '# TYPE carboncast_span_duration_seconds histogram']
+        with self._lock:
+            histograms = {labels: {**histogram, 'buckets': list(histogram['buckets'])} for labels, histogram in self._histograms.items()}
+            trace_counts = dict(self._trace_counts)
+        for (name, cached), histogram in sorted(histograms.items()):
+            labels = f'span="{_prometheus_label(name)}"' + (f',cached="{cached}"' if cached else '')
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                lines.append(f'carboncast_span_duration_seconds_bucket{{{labels},le="{bound:g}"}} {count}')
+            lines.append(f'carboncast_span_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+            lines.append(f'carboncast_span_duration_seconds_sum{{{labels}}} {histogram["sum"]:.6f}')
+            lines.append(f'carboncast_span_duration_seconds_count{{{labels}}} {histogram["count"]}')
+        lines += ['# HELP carboncast_traces_total Traces recorded, by kind.', '# TYPE carboncast_traces_total counter']
+        lines += [f'carboncast_traces_total{{trace="{_prometheus_label(name)}"}} {count}' for name, count in sorted(trace_counts.items())]
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,155 @@
+import concurrent.futures
+import hashlib
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+
+import numpy as np
+
+from forecasters import fit_damped_trend, fit_damped_trend_panel, forecast_damped_trend, forecast_damped_trend_panel
+
+# Longest an upload may spend fitting, counted from when its first fit starts running on a worker
+UPLOAD_TIME_BUDGET_SECONDS = 10
+
+# One worker per scope column (Scope 1, 2 and 3)
+UPLOAD_WORKERS = 3
+
+# How often a waiting upload checks its time budget
+POLL_SECONDS = 0.05
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Workers report (job id, wall-clock time) here when they start a job, so time spent queued behind other
+# sessions' uploads is not charged to an upload's budget
+_started = None
+_start_times = {}
+_start_lock = threading.Lock()
+_job_ids = itertools.count()
+
+
+# Content hash of the uploaded file, used to cache fitted forecasts across reruns and re-uploads
+def upload_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _fit_and_forecast(values, fh):
+    return forecast_damped_trend(fit_damped_trend(values), fh)
+
+
+def _ready(_):
+    return True
+
+
+def _init_worker(started):
+    global _started
+    _started = started
+
+
+def _run_job(job_id, fn, *args):
+    _started.put((job_id, time.time()))
+    return fn(*args)
+
+
+# Shared worker pool; spawned rather than forked because the Streamlit server is multi-threaded.
+# Waits until the workers answer, so their start-up time is not charged to an upload's time budget.
+def _get_pool():
+    global _pool, _started
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context('spawn')
+            _started = context.Queue()
+            _pool = concurrent.futures.ProcessPoolExecutor(UPLOAD_WORKERS, mp_context=context, initializer=_init_worker,
+                                                           initargs=(_started,))
+            list(_pool.map(_ready, range(UPLOAD_WORKERS)))
+        return _pool
+
+
+# Only for a pool whose workers died; a slow upload never takes the pool down for everyone else
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Start times of whichever of job_ids the workers have started so far. Only jobs someone is still
+# waiting on are tracked; late reports for the others are dropped.
+def _job_start_times(job_ids):
+    with _start_lock:
+        while True:
+            try:
+                job_id, started = _started.get_nowait()
+            except queue.Empty:
+                break
+            if job_id in _start_times:
+                _start_times[job_id] = started
+        return [_start_times[job_id] for job_id in job_ids if _start_times.get(job_id) is not None]
+
+
+# Run {key: (fn, args)} on the shared pool; returns ({key: result}, {key: exception}). Raises TimeoutError
+# once time_budget seconds have passed since the first of these jobs started; only this call's jobs
+# that have not started yet are cancelled then, and a fit already running finishes on its worker.
+def _run_jobs(jobs, time_budget):
+    pool = _get_pool()
+    futures = {}
+    for key, (fn, args) in jobs.items():
+        job_id = next(_job_ids)
+        with _start_lock:
+            _start_times[job_id] = None
+        futures[pool.submit(_run_job, job_id, fn, *args)] = (key, job_id)
+    job_ids = [job_id for _, job_id in futures.values()]
+
+    try:
+        pending = set(futures)
+        while pending:
+            _, pending = concurrent.futures.wait(pending, timeout=POLL_SECONDS)
+            started = _job_start_times(job_ids)
+            if pending and started and time.time() - min(started) > time_budget:
+                for future in pending:
+                    future.cancel()
+                raise TimeoutError(f"Fitting the uploaded data took longer than {time_budget} seconds")
+    finally:
+        with _start_lock:
+            for job_id in job_ids:
+                _start_times.pop(job_id, None)
+
+    results, errors = {}, {}
+    for future, (key, _) in futures.items():
+        try:
+            results[key] = future.result()
+        except concurrent.futures.process.BrokenProcessPool:
+            _discard_pool(pool)
+            raise
+        except Exception as e:
+            errors[key] = e
+    return results, errors
+
+
+# Fit one forecaster per column of the uploaded frame in parallel and forecast fh years ahead.
+# Columns without any values, or whose fit fails, are left out rather than failing the other scopes.
+# Raises TimeoutError if the upload does not finish within time_budget seconds of starting.
+def forecast_upload(user_data, fh=30, time_budget=UPLOAD_TIME_BUDGET_SECONDS):
+    jobs = {column: (_fit_and_forecast, (user_data[column].to_numpy(dtype='float64'), fh))
+            for column in user_data.columns if user_data[column].notna().any()}
+    results, _ = _run_jobs(jobs, time_budget)
+    return {column: np.asarray(result) for column, result in results.items()}
+
+
+def _fit_and_forecast_panel(panel, fh):
+    return forecast_damped_trend_panel(fit_damped_trend_panel(panel), fh)
+
+
+# Forecast every series of a long-format upload (upload_ingest.LongUpload) with vectorised panel fits,
+# one block of series per worker, under the same time budget as a wide upload.
+def forecast_long_upload(upload, fh=30, time_budget=UPLOAD_TIME_BUDGET_SECONDS):
+    names, _, panel = upload.panel()
+    blocks = [rows for rows in np.array_split(np.arange(len(names)), UPLOAD_WORKERS) if len(rows)]
+    results, errors = _run_jobs({i: (_fit_and_forecast_panel, (panel[rows], fh)) for i, rows in enumerate(blocks)}, time_budget)
+    if errors:
+        raise next(iter(errors.values()))
+    forecasts = np.vstack([results[i] for i in range(len(blocks))]) if blocks else np.empty((0, fh))
+    return {f"{name} Original": row for name, row in zip(names, forecasts)}
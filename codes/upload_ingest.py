@@ -0,0 +1,206 @@
+import io
+import re
+
+import numpy as np
+import pandas as pd
+
+from forecast_service import SCOPES
+
+# Rows parsed per chunk; bounds the memory of the raw text being validated at any one time
+INGEST_CHUNK_ROWS = 50_000
+
+# Largest long-format upload accepted, checked while streaming so oversized files stop early
+MAX_UPLOAD_ROWS = 5_000_000
+
+# Rejected rows listed in an error before the rest are summarised as a count
+MAX_REPORTED_ERRORS = 10
+
+YEAR_RANGE = (1900, 2100)
+
+# Long-format column -> accepted header spellings (compared case-insensitively, spaces ignored)
+LONG_COLUMNS = {
+    'entity': ('entity', 'company', 'subsidiary'),
+    'scope': ('scope',),
+    'year': ('year', 'date'),
+    'value': ('emissions', 'value'),
+}
+
+_HEADER_ALIASES = {alias: column for column, aliases in LONG_COLUMNS.items() for alias in aliases}
+
+
+class UploadValidationError(ValueError):
+    """An upload that does not match the long format; errors holds (line number, reason) pairs."""
+
+    def __init__(self, errors, total=None):
+        self.errors = errors
+        self.total = len(errors) if total is None else total
+        lines = [f"line {line}: {reason}" if line else reason for line, reason in errors[:MAX_REPORTED_ERRORS]]
+        if self.total > len(lines):
+            lines.append(f"... and {self.total - len(lines)} more")
+        super().__init__("Invalid upload:\n" + "\n".join(lines))
+
+
+def _normalise_header(name):
+    return re.sub(r'\s+', '', str(name)).lower().lstrip('\ufeff')
+
+
+# True when the header row names an entity and a scope column, i.e. one row per entity, scope and year
+def is_long_format(data):
+    header = data[:4096].decode('utf-8-sig', errors='replace').splitlines()[0] if data else ''
+    columns = {_HEADER_ALIASES.get(_normalise_header(name)) for name in header.split(',')}
+    return {'entity', 'scope'} <= columns
+
+
+# Parse cells as numbers in one vectorised pass; only the cells that fail go through the slower fallback
+def _to_numbers(cells, fallback):
+    numbers = pd.to_numeric(cells, errors='coerce')
+    retry = numbers.isna() & (cells != '')
+    if retry.any():
+        numbers = numbers.astype('float64')
+        numbers[retry] = fallback(cells[retry].str.strip())
+    return numbers
+
+
+# Years written as dates ('1/1/2018', '2018-01-01') rather than 'YYYY'
+def _date_years(cells):
+    return pd.to_datetime(cells, format='mixed', errors='coerce').dt.year
+
+
+# Validate one chunk of raw text cells; returns the parsed columns and the (line, reason) of bad rows
+def _parse_chunk(chunk):
+    entities = chunk['entity'].str.strip()
+    scopes = _to_numbers(chunk['scope'], lambda cells: pd.to_numeric(cells.str.extract(r'(\d+)$', expand=False), errors='coerce'))
+    years = _to_numbers(chunk['year'], _date_years)
+    values = _to_numbers(chunk['value'], lambda cells: pd.to_numeric(cells.str.replace(',', '', regex=False), errors='coerce'))
+
+    checks = [
+        (entities == '', "missing entity"),
+        (~scopes.isin(SCOPES), f"scope must be one of {', '.join(map(str, SCOPES))}"),
+        (~years.between(*YEAR_RANGE) | (years % 1 != 0), f"year must be between {YEAR_RANGE[0]} and {YEAR_RANGE[1]}"),
+        (~np.isfinite(values), "emissions must be a number"),
+    ]
+    lines = chunk.index.to_numpy() + 2
+    errors = [(int(line), reason) for invalid, reason in checks for line in lines[invalid.to_numpy()]]
+    return entities, scopes, years, values, sorted(errors)
+
+
+class LongUpload:
+    """A long-format upload (Entity, Scope, Year, Emissions) held as compact sorted arrays.
+
+    Rows are sorted by entity, scope and year, and each (entity, scope) series is one contiguous
+    block, the same layout HistoryStore serves the company data from.
+    """
+
+    def __init__(self, entities, entity_codes, scopes, years, values):
+        order = np.lexsort((years, scopes, entity_codes))
+        self.entities = entities
+        self.entity = entity_codes[order]
+        self.scope = scopes[order]
+        self.year = years[order]
+        self.value = values[order]
+        self._index = self._build_index()
+
+    def _build_index(self):
+        index = {}
+        if len(self.year) == 0:
+            return index
+        boundaries = np.flatnonzero((self.entity[1:] != self.entity[:-1]) | (self.scope[1:] != self.scope[:-1])) + 1
+        for start, stop in zip(np.concatenate([[0], boundaries]), np.concatenate([boundaries, [len(self.year)]])):
+            index[f"{self.entities[self.entity[start]]} Scope {self.scope[start]}"] = (start, stop)
+        return index
+
+    def __len__(self):
+        return len(self.year)
+
+    def series_names(self):
+        return list(self._index)
+
+    # Years and values of one series, e.g. upload.series('Acme Ltd Scope 1')
+    def series(self, name):
+        start, stop = self._index[name]
+        return self.year[start:stop], self.value[start:stop]
+
+    # (series x years) array of every series aligned on calendar year, NaN where a series has no value,
+    # built straight from the sorted arrays for the panel forecaster
+    def panel(self):
+        years = np.unique(self.year)
+        starts = np.array([start for start, _ in self._index.values()], dtype='int64')
+        rows = np.searchsorted(starts, np.arange(len(self.year)), side='right') - 1
+        panel = np.full((len(starts), len(years)), np.nan)
+        panel[rows, np.searchsorted(years, self.year)] = self.value
+        return self.series_names(), years, panel
+
+    # Wide frame of the selected entities in the upload layout: '{entity} Scope N Original' columns
+    def frame(self, entities):
+        columns = {}
+        for entity in entities:
+            for scope in SCOPES:
+                name = f"{entity} Scope {scope}"
+                if name in self._index:
+                    years, values = self.series(name)
+                    columns[f"{name} Original"] = pd.Series(values, index=years)
+        wide = pd.DataFrame(columns).sort_index()
+        wide.index = pd.DatetimeIndex(pd.to_datetime(wide.index.astype(str), format='%Y'), name='Year')
+        return wide
+
+
+# Stream a long-format CSV in chunks, rejecting the file at the first chunk with a malformed row.
+# Only the four long-format columns are kept, converted to compact arrays as each chunk is read;
+# any other columns are read as text and dropped with the chunk.
+def ingest_long_upload(source, chunksize=INGEST_CHUNK_ROWS, max_rows=MAX_UPLOAD_ROWS):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    header = {}
+    try:
+        reader = pd.read_csv(source, dtype=str, keep_default_na=False, encoding='utf-8-sig', chunksize=chunksize)
+        entity_ids = {}
+        parts = {'entity': [], 'scope': [], 'year': [], 'value': [], 'line': []}
+        rows = 0
+        for chunk in reader:
+            if not header:
+                header = {column: _HEADER_ALIASES[_normalise_header(column)] for column in chunk.columns
+                          if _normalise_header(column) in _HEADER_ALIASES}
+                missing = set(LONG_COLUMNS) - set(header.values())
+                if len(set(header.values())) < len(header):
+                    raise UploadValidationError([(None, f"more than one column for the same field: {', '.join(header)}")])
+                if missing:
+                    raise UploadValidationError([(None, f"missing column(s): {', '.join(sorted(missing))}")])
+            chunk = chunk[list(header)].rename(columns=header)
+
+            if not isinstance(chunk.index, pd.RangeIndex):
+                raise UploadValidationError([(None, "rows have more fields than the header")])
+            rows += len(chunk)
+            if rows > max_rows:
+                raise UploadValidationError([(None, f"more than {max_rows:,} rows")])
+
+            entities, scopes, years, values, errors = _parse_chunk(chunk)
+            if errors:
+                raise UploadValidationError(errors)
+
+            codes, uniques = pd.factorize(entities)
+            global_codes = np.array([entity_ids.setdefault(entity, len(entity_ids)) for entity in uniques], dtype='int32')
+            parts['entity'].append(global_codes[codes])
+            parts['scope'].append(scopes.to_numpy(dtype='int8'))
+            parts['year'].append(years.to_numpy(dtype='int16'))
+            parts['value'].append(values.to_numpy(dtype='float64'))
+            parts['line'].append(chunk.index.to_numpy(dtype='int64') + 2)
+    except pd.errors.ParserError as e:
+        raise UploadValidationError([(None, str(e))]) from e
+    except pd.errors.EmptyDataError as e:
+        raise UploadValidationError([(None, "the file is empty")]) from e
+
+    if not entity_ids:
+        raise UploadValidationError([(None, "no rows found")])
+    arrays = {key: np.concatenate(value) for key, value in parts.items()}
+
+    # A year may only appear once per series
+    order = np.lexsort((arrays['year'], arrays['scope'], arrays['entity']))
+    keys = np.stack([arrays['entity'][order], arrays['scope'][order], arrays['year'][order]], axis=1)
+    duplicate = np.flatnonzero((keys[1:] == keys[:-1]).all(axis=1)) + 1
+    if len(duplicate):
+        lines = arrays['line'][order][duplicate]
+        raise UploadValidationError([(int(line), "duplicate entity, scope and year") for line in np.sort(lines)])
+
+    entities = list(entity_ids)
+    return LongUpload(entities, arrays['entity'], arrays['scope'], arrays['year'], arrays['value'])